@@ -1,18 +1,371 @@
 import pandas as pd
-import datetime
+import numpy as np
+import csv
+import functools
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
 
+try:
+    import pyarrow
+    import pyarrow.compute as pc
+    from pyarrow import csv as arrow_csv, feather
+    TEXT_DTYPE = pd.StringDtype('pyarrow')
+except ImportError:  # pyarrow is optional, without it free text stays as Python strings and nothing is cached
+    pyarrow = pc = arrow_csv = feather = None
+    TEXT_DTYPE = object
 
-def get_df_from_csv(filename):
+DEMOGRAPHIC_COLUMNS = ['Gender', 'Education Level', 'US Region', 'UK Region']
+DIMENSION_COLUMNS = DEMOGRAPHIC_COLUMNS + ['Age', 'Year Of Birth']  # Everything get_dimension_table reads
+SCHEMA_SAMPLE_ROWS = 10000
+CATEGORY_RATIO = 0.5  # Text columns with at most this share of distinct answers are loaded as categoricals
+CHUNK_ROWS = 100000  # Rows read at a time when streaming a sheet
+
+# The values pandas reads as missing by default, so both CSV engines agree on what's blank
+NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A',
+             'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+
+def get_df_from_csv(filename, typed=True, cache=True, questions=None, engine='c'):
+    """
+    Read data from a CSV file into a DataFrame. Unless typed is False, answer columns are loaded with the types
+    inferred by get_csv_schema and numbers are shrunk to the smallest type that holds them, and the memory saved
+    is reported. Typed loads are cached next to the CSV by get_cache_filename, so later runs skip parsing until the
+    CSV's contents change.
+
+    If questions is a list, only the demographic columns and the columns of those questions are read. Any other
+    question asked for later is read from the same file when get_question_columns first looks for it. When the cache
+    doesn't exist yet, the whole sheet is parsed once to write it and the columns are then read from the cache.
+
+    With engine='pyarrow' the CSV is parsed on every core by read_csv_columns, giving the same DataFrame.
+    """
+    if not typed:
+        df = read_csv_columns(filename, engine=engine)
+        get_question_index(df)  # Build the question index once at load
+        return df
+
+    columns = get_load_columns(filename, questions)
+    cache_filename = get_cache_filename(filename) if cache and feather is not None else None
+    if cache_filename is not None and not os.path.exists(cache_filename):
+        # The cache holds the whole sheet, so the first load parses every column once and later loads prune from it
+        write_cache(read_typed_csv(filename, engine=engine), filename, cache_filename)
+
+    if cache_filename is not None:
+        df = feather.read_table(cache_filename, columns=columns, memory_map=True).to_pandas()
+    else:
+        df = read_typed_csv(filename, columns, engine)
+
+    if columns is not None:
+        # Lets get_question_columns read the rest of the sheet on demand
+        df.attrs['source'] = filename
+        df.attrs['engine'] = engine
+    get_question_index(df)  # Build the question index once at load
+
+    return df
+
+
+def read_typed_csv(filename, columns=None, engine='c'):
     """
-    Read data from a CSV file into a DataFrame.
+    Parse the given columns of a CSV (all of them if columns is None) with the types from get_csv_schema, shrinking
+    the numeric columns once they're loaded.
     """
-    df = pd.read_csv(filename)
+    schema, sample = get_csv_schema(filename, columns=columns)
+    df = downcast_numbers(read_csv_columns(filename, columns, schema, engine))
+
+    # Estimate the untyped size from the sample, as loading the whole file untyped is what we're avoiding
+    untyped_memory = sample.memory_usage(deep=True).sum() * len(df) / max(len(sample), 1)
+    typed_memory = df.memory_usage(deep=True).sum()
+    print(f'Loaded {filename} in {typed_memory / 1e6:.1f} MB, saving about '
+          f'{(untyped_memory - typed_memory) / 1e6:.1f} MB over untyped columns')
+
     return df
 
 
+def read_csv_columns(filename, columns=None, schema=None, engine='c'):
+    """
+    Parse the given columns of a CSV (all of them if columns is None) with the types in schema. The 'c' engine is
+    pandas' own parser. The 'pyarrow' engine parses blocks of the file in parallel, reading text columns as strings
+    and inferring numbers the way pandas does, then applies the same schema. If pyarrow isn't installed, or a column
+    has numbers in the sample and text later on, the file is parsed with pandas instead so the result is the same.
+    """
+    header = get_csv_header(filename)
+    schema = schema or {}
+
+    if engine == 'pyarrow' and arrow_csv is not None:
+        read_options = arrow_csv.ReadOptions(column_names=list(header), skip_rows=1, use_threads=True)
+        parse_options = arrow_csv.ParseOptions(newlines_in_values=True)
+        convert_options = arrow_csv.ConvertOptions(include_columns=columns, null_values=NA_VALUES,
+                                                   strings_can_be_null=True,
+                                                   column_types={column: pyarrow.string() for column in schema})
+        try:
+            table = arrow_csv.read_csv(filename, read_options, parse_options, convert_options)
+        except pyarrow.ArrowInvalid as error:
+            print(f'Parsing {filename} with pandas instead of pyarrow: {error}')
+        else:
+            # Columns that were numbers in the sample but have text further down are mixed types in pandas
+            mixed = [field.name for field in table.schema
+                     if field.name not in schema and pyarrow.types.is_string(field.type)]
+            if not mixed:
+                return table.to_pandas().astype(schema)
+            print(f'Parsing {filename} with pandas instead of pyarrow, as {", ".join(mixed)} mix numbers and text')
+
+    return pd.read_csv(filename, header=0, names=header, usecols=columns, dtype=schema or None)
+
+
+def get_csv_header(filename):
+    """
+    Returns every column name in the CSV, with repeated headers numbered the way pandas loads them.
+    """
+    return tuple(pd.read_csv(filename, nrows=0).columns)
+
+
+def get_load_columns(filename, questions=None):
+    """
+    Returns the columns of the CSV needed for the given questions and the demographic sections, in sheet order, or
+    None for every column if questions is None.
+    """
+    if questions is None:
+        return None
+
+    header = get_csv_header(filename)
+    wanted = set(DIMENSION_COLUMNS)
+    for question in questions:
+        wanted.update(header[position] for position in find_question_positions(header, question))
+    return [column for column in header if column in wanted]
+
+
+def read_csv_in_chunks(filename, questions=None, chunksize=CHUNK_ROWS, start=None, schema=None):
+    """
+    Read the sheet chunksize rows at a time, typed the same way as get_df_from_csv, so a sheet of any size can be
+    counted in bounded memory. Each chunk keeps its row numbers in the sheet as its index. As with get_df_from_csv,
+    questions limits the columns read. start is a (byte offset, row) pair at the start of a row, to only read the rows
+    from there on. schema replaces the types worked out from the file's first rows, so a shard of a sheet can be read
+    with the types of the whole sheet.
+    """
+    columns = get_load_columns(filename, questions)
+    if schema is None:
+        schema, _ = get_csv_schema(filename, columns=columns)
+    else:
+        schema = {column: dtype for column, dtype in schema.items() if columns is None or column in columns}
+    if start is None:
+        chunks = pd.read_csv(filename, header=0, names=get_csv_header(filename), usecols=columns, dtype=schema,
+                             chunksize=chunksize)
+        for chunk in chunks:
+            yield downcast_numbers(chunk)
+        return
+
+    offset, row = start
+    with open(filename, 'rb') as f:
+        f.seek(offset)
+        try:
+            chunks = pd.read_csv(f, header=None, names=get_csv_header(filename), usecols=columns, dtype=schema,
+                                 chunksize=chunksize)
+        except pd.errors.EmptyDataError:  # Nothing after the offset but blank lines
+            return
+        for chunk in chunks:
+            chunk.index += row
+            yield downcast_numbers(chunk)
+
+
+def get_file_hash(filename, size=None):
+    """
+    Return a hash of the file's contents, or of only its first size bytes, read in blocks so big exports never have to
+    fit in memory.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    remaining = os.path.getsize(filename) if size is None else size
+    with open(filename, 'rb') as f:
+        while remaining > 0:
+            block = f.read(min(remaining, 1 << 20))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+
+def get_file_fingerprint(filename):
+    """
+    Return a hash of the file's contents, read in blocks so big exports never have to fit in memory. The hash is saved
+    next to the file with its size and modification time, and only recomputed when either of those change.
+    """
+    stat = os.stat(filename)
+    fingerprint_filename = f'{os.path.splitext(filename)[0]}-fingerprint.json'
+    if os.path.exists(fingerprint_filename):
+        with open(fingerprint_filename) as f:
+            saved = json.load(f)
+        if saved['size'] == stat.st_size and saved['mtime'] == stat.st_mtime_ns:
+            return saved['fingerprint']
+
+    fingerprint = get_file_hash(filename)
+    with open(fingerprint_filename, 'w') as f:
+        json.dump({'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'fingerprint': fingerprint}, f)
+
+    return fingerprint
+
+
+def get_cache_filename(filename):
+    """
+    Returns the name of the columnar copy of a CSV, keyed by the hash of its contents.
+    """
+    return f'{os.path.splitext(filename)[0]}-{get_file_fingerprint(filename)}.feather'
+
+
+def write_cache(df, filename, cache_filename):
+    """
+    Save the loaded DataFrame as an uncompressed Feather file so later loads can memory-map it, removing copies made
+    from older versions of the CSV.
+    """
+    base = os.path.splitext(filename)[0]
+    for old_filename in glob.glob(f'{glob.escape(base)}-*.feather'):
+        if re.fullmatch(r'-[0-9a-f]{32}\.feather', old_filename[len(base):]):
+            os.remove(old_filename)
+
+    # Write to a temporary file first so an interrupted run never leaves a partial cache behind
+    df.to_feather(f'{cache_filename}.tmp', compression='uncompressed')
+    os.replace(f'{cache_filename}.tmp', cache_filename)
+
+
+def get_csv_schema(filename, sample_rows=SCHEMA_SAMPLE_ROWS, columns=None):
+    """
+    Infer the type of every text column from a sample of the sheet: demographic columns and single-response style
+    columns with few distinct answers are categoricals, and other text is Arrow-backed strings. Numeric columns are
+    left out so they can be shrunk once the whole column is loaded. Returns the schema along with the sample, which
+    only has the given columns if any are given.
+    """
+    sample = pd.read_csv(filename, header=0, names=get_csv_header(filename), usecols=columns, nrows=sample_rows)
+    schema = {}
+
+    for column in sample.columns:
+        values = sample[column].dropna()
+        if pd.api.types.is_numeric_dtype(sample[column]):
+            continue
+        elif column in DEMOGRAPHIC_COLUMNS or values.nunique() <= CATEGORY_RATIO * len(values):
+            schema[column] = 'category'
+        else:
+            schema[column] = TEXT_DTYPE
+
+    return schema, sample
+
+
+def downcast_numbers(df):
+    """
+    Shrink whole number columns such as Year Of Birth, Age and slider ratings to the smallest integer type, or to
+    float32 when they have missing values, without changing any value.
+    """
+    for column in df.select_dtypes('number').columns:
+        values = df[column]
+        if pd.api.types.is_integer_dtype(values):
+            df[column] = pd.to_numeric(values, downcast='integer')
+        elif values.dropna().eq(values.dropna().round()).all() and values.abs().max() < 2 ** 24:
+            df[column] = values.astype(np.float32)
+
+    return df
+
+
+@functools.lru_cache(maxsize=16)
+def build_question_index(columns):
+    """
+    Map every column name, full question text and question number (e.g. 'Q15') to the positions of its columns.
+    Repeated headers, which pandas loads as 'text', 'text.1', 'text.2', ..., are grouped under the same question text.
+    """
+    column_names = set(columns)
+    question_index = {}
+
+    for position, column in enumerate(columns):
+        keys = [column]
+        question_text = re.sub(r'\.\d+$', '', str(column))
+        if question_text != column and question_text in column_names:
+            keys.append(question_text)
+        question_number = re.match(r'(Q\d+):', str(column))
+        if question_number:
+            keys.append(question_number.group(1))
+
+        for key in keys:
+            question_index.setdefault(key, []).append(position)
+
+    return question_index
+
+
+def get_question_index(df):
+    return build_question_index(tuple(df.columns))
+
+
+def find_question_positions(columns, question):
+    """
+    Return the positions of all columns holding a question, found by full question text, column name or question
+    number. Returns an empty list if the question isn't in the sheet.
+    """
+    question_index = build_question_index(tuple(columns))
+    positions = question_index.get(question)
+
+    if positions is None:
+        question_number = re.match(r'(Q\d+):', question)
+        if question_number:
+            positions = question_index.get(question_number.group(1))
+    if positions is None:
+        # Fall back to a scan for headers that contain the question
+        positions = [position for position, column in enumerate(columns) if question in column]
+
+    return positions
+
+
+def get_question_columns(df, question):
+    """
+    Return the names of all columns holding a question, found by full question text, column name or question number.
+    Returns an empty list if the question isn't in the sheet. If the DataFrame was loaded for only some questions,
+    a question that hasn't been loaded yet is read from the CSV and added to it first.
+    """
+    positions = find_question_positions(df.columns, question)
+    if not positions and 'source' in df.attrs:
+        load_question_columns(df, question)
+        positions = find_question_positions(df.columns, question)
+
+    return list(df.columns[positions])
+
+
+def load_question_columns(df, question):
+    """
+    Read a question's columns from the CSV a DataFrame was loaded from and add them to it, typed the same way as a
+    full load.
+    """
+    filename = df.attrs['source']
+    header = get_csv_header(filename)
+    columns = [header[position] for position in find_question_positions(header, question)
+               if header[position] not in df.columns]
+    if not columns:
+        return
+
+    loaded = get_df_from_csv(filename, questions=[question], engine=df.attrs.get('engine', 'c'))
+    for column in columns:
+        df[column] = loaded[column]
+
+
+def get_question_column(df, question):
+    """
+    Return the name of the first column holding a question, or None if the question isn't in the sheet.
+    """
+    question_columns = get_question_columns(df, question)
+    if question_columns:
+        return question_columns[0]
+    else:
+        return None
+
+
+def get_unique_values(column):
+    """
+    Return the distinct answers in a column in order of first appearance, as a plain array even if the column is a
+    categorical.
+    """
+    return np.asarray(column.dropna().unique())
+
+
 def get_gender_list(df):
     if 'Gender' in df.columns:
-        genders = df['Gender'].dropna().unique()
+        genders = get_unique_values(df['Gender'])
         return genders
     else:
         return pd.Series(dtype=int)
@@ -20,124 +373,719 @@ def get_gender_list(df):
 
 def get_age_list(df):
     if 'Age' in df.columns:
-        age = df['Age'].dropna().unique()
+        age = get_unique_values(df['Age'])
         return age
     else:
         return pd.Series(dtype=int)
 
 
-def get_generations_list():
-    return ['Gen Z', 'Millennial', 'Gen X', 'Baby Boomer']
+# Birth years (first, last) of each generation, youngest first
+GENERATIONS = {
+    'Gen Alpha': (2013, 2024),
+    'Gen Z': (1997, 2012),
+    'Millennial': (1981, 1996),
+    'Gen X': (1965, 1980),
+    'Baby Boomer': (1946, 1964),
+    'Silent Generation': (1928, 1945),
+}
+
+
+def get_generations_list(generations=None):
+    if generations is None:
+        generations = GENERATIONS
+    return list(generations)
 
 
 def get_education_list(df):
     if 'Education Level' in df.columns:
-        education = df['Education Level'].dropna().unique()
+        education = get_unique_values(df['Education Level'])
         return education
     else:
         return pd.Series(dtype=int)
 
 
-def get_region_list(df):
-    if 'US Region' in df.columns:
-        regions = df['US Region'].dropna().unique()
-        return regions
-    elif 'UK Region' in df.columns:
-        regions = ['London', 'Northern England', 'Midlands (England)', 'Southern England', 'Scotland', 'Wales',
-                   'Northern Ireland']
+# Subregion -> (region, nation) for each region column. US regions are used as exported, within one nation.
+REGION_HIERARCHY = {
+    'US Region': None,
+    'UK Region': {
+        'London': ('London', 'England'),
+        'North East (England': ('Northern England', 'England'),  # Pollfish mistake with )
+        'North West (England)': ('Northern England', 'England'),
+        'Yorkshire And The Humber': ('Northern England', 'England'),
+        'West Midlands (England)': ('Midlands (England)', 'England'),
+        'East Midlands (England)': ('Midlands (England)', 'England'),
+        'South East (England)': ('Southern England', 'England'),
+        'East Of England': ('Southern England', 'England'),
+        'South West (England)': ('Southern England', 'England'),
+        'Scotland': ('Scotland', 'Scotland'),
+        'Wales': ('Wales', 'Wales'),
+        'Northern Ireland': ('Northern Ireland', 'Northern Ireland'),
+    },
+}
+REGION_NATIONS = {'US Region': 'United States'}
+REGION_LEVELS = ['Subregion', 'Region', 'Nation']
+UNMAPPED_REGIONS = 'Unmapped regions'  # Totals of subregions missing from the hierarchy, merged with the counts
+
+
+def get_region_hierarchy(df):
+    """
+    Return the region column of the sheet along with a DataFrame of its hierarchy, indexed by subregion with a
+    column for each level in REGION_LEVELS. Returns None, None if the sheet has no region column.
+    """
+    for column, hierarchy in REGION_HIERARCHY.items():
+        if column in df.columns:
+            if hierarchy is None:
+                subregions = get_unique_values(df[column])
+                hierarchy = {subregion: (subregion, REGION_NATIONS[column]) for subregion in subregions}
+            table = pd.DataFrame.from_dict(hierarchy, orient='index', columns=REGION_LEVELS[1:])
+            table.insert(0, 'Subregion', table.index)
+            return column, table
+
+    return None, None
+
+
+def get_region_list(df, level='Region'):
+    column, hierarchy = get_region_hierarchy(df)
+    if column is None:
+        return pd.Series(dtype=int)
+    elif level == 'Subregion':
+        regions = get_unique_values(df[column])
         return regions
     else:
-        return pd.Series(dtype=int)
+        regions = list(hierarchy[level].unique())
+        return regions
+
+
+def get_empty_column(df):
+    return pd.Series(None, index=df.index, dtype=object)
 
 
-def get_gender(df, respondent):
+def get_gender_column(df):
+    """
+    Return the gender of every respondent as a Series aligned with the DataFrame.
+    """
     if 'Gender' in df.columns:
-        gender = df.loc[respondent, 'Gender']
-        return gender
+        return df['Gender']
     else:
-        return None
+        return get_empty_column(df)
 
 
-def get_age(df, respondent):
+def get_age_column(df):
     if 'Age' in df.columns:
-        age = df.loc[respondent, 'Age']
-        return age
+        return df['Age']
     else:
-        return None
+        return get_empty_column(df)
 
 
-def get_generation(df, respondent):
-    if 'Year Of Birth' not in df.columns and 'Age' not in df.columns:
-        return None
-
-    current_year = datetime.datetime.now().year
+def get_generation_column(df, field_date=None, generations=None):
+    """
+    Return the generation of every respondent as a categorical, binning their year of birth into the birth year ranges
+    in generations (GENERATIONS by default) with one sorted lookup. If there's no year of birth, the birth year is
+    worked out from the respondent's age on field_date, the date the survey was in field, and without a field date
+    nobody is given a generation, rather than generations shifting with the day the export is run.
+    """
+    if generations is None:
+        generations = GENERATIONS
 
     if 'Year Of Birth' in df.columns:
-        year = df.loc[respondent, 'Year Of Birth']
-        if 1997 <= year <= 2012:
-            return 'Gen Z'
-        elif 1981 <= year <= 1996:
-            return 'Millennial'
-        elif 1965 <= year <= 1980:
-            return 'Gen X'
-        elif 1946 <= year <= 1964:
-            return 'Baby Boomer'
-        else:
-            return None
-
-    elif 'Age' in df.columns:
-        age = df.loc[respondent, 'Age']
-        birth_year = current_year - age
-        if 1997 <= birth_year <= 2012:
-            return 'Gen Z'
-        elif 1981 <= birth_year <= 1996:
-            return 'Millennial'
-        elif 1965 <= birth_year <= 1980:
-            return 'Gen X'
-        elif 1946 <= birth_year <= 1964:
-            return 'Baby Boomer'
-        else:
-            return None
-
+        birth_years = pd.to_numeric(df['Year Of Birth'], errors='coerce').to_numpy(dtype=float)
+    elif 'Age' in df.columns and field_date is not None:
+        birth_years = field_date.year - pd.to_numeric(df['Age'], errors='coerce').to_numpy(dtype=float)
     else:
-        return None
+        birth_years = np.full(len(df), np.nan)
+
+    # Find the generation starting at or before each birth year, then check the year is within its range
+    names = get_generations_list(generations)
+    order = np.argsort([first for first, last in generations.values()])
+    firsts = np.array([generations[names[i]][0] for i in order])
+    lasts = np.array([generations[names[i]][1] for i in order])
+    positions = np.searchsorted(firsts, birth_years, side='right') - 1
+    in_range = (positions >= 0) & (birth_years <= lasts[positions.clip(0)])
+    codes = np.where(in_range, order[positions.clip(0)], -1)
+
+    return pd.Series(pd.Categorical.from_codes(codes, categories=names), index=df.index)
+
+
+def is_missing_field_date(columns, field_date):
+    # Generations of a sheet with Age but no Year Of Birth can only be worked out from the date it was in field
+    return field_date is None and 'Age' in columns and 'Year Of Birth' not in columns
 
 
-def get_education(df, respondent):
+def warn_missing_field_date(columns, field_date):
+    if is_missing_field_date(columns, field_date):
+        print('WARNING: this sheet has Age but no Year Of Birth and no field_date is set, so nobody is counted in a '
+              'generation. Set field_date, or "field_date" in the report\'s manifest.json, to count generations.')
+
+
+def check_generation_sections(columns, field_date, sections):
+    """
+    Stop when Generation Data is one of the sections asked for, but the sheet's generations can't be worked out
+    without a field date.
+    """
+    if sections is not None and 'Generation Data' in sections and is_missing_field_date(columns, field_date):
+        print('Generation Data needs the date the survey was in field, since this sheet has Age but no Year Of Birth. '
+              'Please set field_date, or "field_date" in the report\'s manifest.json.')
+        sys.exit(1)
+
+
+def get_education_column(df):
     if 'Education Level' in df.columns:
-        education = df.loc[respondent, 'Education Level']
-        return education
+        return df['Education Level']
     else:
-        return None
+        return get_empty_column(df)
+
+
+def get_region_column(df, level='Region'):
+    """
+    Return the region of every respondent at the given level of the region hierarchy, with one categorical map over
+    the whole column. Respondents whose subregion is missing from the hierarchy have no region.
+    """
+    column, hierarchy = get_region_hierarchy(df)
+    if column is None:
+        return get_empty_column(df)
+    elif level == 'Subregion':
+        return df[column]
+
+    subregions = df[column].astype('category')
+    regions = subregions.map(hierarchy[level].to_dict()).astype(object)
+    return regions
+
+
+def get_unmapped_region_counts(df, dimensions):
+    """
+    Count the respondents of each subregion missing from the region hierarchy, who are left out of the region and
+    nation counts, as a count table for each level, which merge_counts can add up across chunks of the sheet.
+    """
+    subregions = dimensions['Subregion']
+    group_codes, group_list = get_dimension_codes(subregions)
+    counts = {}
+    for level in REGION_LEVELS[1:]:
+        codes = np.where(dimensions[level].isna().to_numpy(), group_codes, -1)
+        level_counts = np.bincount(codes[codes >= 0], minlength=len(group_list))
+        counts[level] = make_count_table([(group_list, get_first_rows(df, codes, len(group_list)))], level_counts)
+
+    return counts
+
 
+def report_unmapped_regions(counts):
+    """
+    Print the respondents left out of the region and nation counts, once for the whole sheet, given counts from
+    get_unmapped_region_counts.
+    """
+    for level, table in counts.items():
+        (subregions,), level_counts = sort_count_table(table)
+        unmapped = sorted(((count, subregion) for subregion, count in zip(subregions, level_counts) if count > 0),
+                          key=lambda pair: -pair[0])
+        if unmapped:
+            print(f'Not included in {level.lower()} counts: {sum(count for count, subregion in unmapped)} '
+                  f'({", ".join(f"{subregion}: {count}" for count, subregion in unmapped)})')
+
+
+def get_dimension_table(df, filename=None, field_date=None, generations=None, report=True):
+    """
+    Compute the gender, age, generation, education and region of every respondent once, as categoricals whose
+    categories are the groups listed by get_gender_list, get_age_list, etc. When filename is the raw data CSV, the table
+    is saved next to it and reused by later runs until the CSV's contents, the field date or the generations change.
+    Subregions missing from the region hierarchy, and a missing field date when one is needed for generations, are
+    reported unless report is False, as it is for chunks of a sheet, which are reported on once for the whole sheet.
+    """
+    settings = {'field_date': field_date, 'generations': dict(generations or GENERATIONS)}
+
+    if filename is not None:
+        settings['fingerprint'] = get_file_fingerprint(filename)
+        dimensions_filename = f'{os.path.splitext(filename)[0]}-dimensions.pkl'
+        if os.path.exists(dimensions_filename):
+            dimensions = pd.read_pickle(dimensions_filename)
+            if dimensions.index.equals(df.index) and dimensions.attrs == settings:
+                if report:
+                    warn_missing_field_date(df.columns, field_date)
+                    report_unmapped_regions(get_unmapped_region_counts(df, dimensions))
+                return dimensions
+
+    dimensions = pd.DataFrame({
+        'Gender': pd.Categorical(get_gender_column(df), categories=get_gender_list(df)),
+        'Age': pd.Categorical(get_age_column(df), categories=get_age_list(df)),
+        'Generation': get_generation_column(df, field_date, generations).array,
+        'Education': pd.Categorical(get_education_column(df), categories=get_education_list(df)),
+        'Region': pd.Categorical(get_region_column(df), categories=get_region_list(df)),
+        'Subregion': pd.Categorical(get_region_column(df, 'Subregion'), categories=get_region_list(df, 'Subregion')),
+        'Nation': pd.Categorical(get_region_column(df, 'Nation'), categories=get_region_list(df, 'Nation')),
+    }, index=df.index)
+    dimensions.attrs = settings
+
+    if filename is not None:
+        dimensions.to_pickle(dimensions_filename)
+    if report:
+        warn_missing_field_date(df.columns, field_date)
+        report_unmapped_regions(get_unmapped_region_counts(df, dimensions))
+
+    return dimensions
+
+
+def get_overall_groups(df, label):
+    """
+    Return a categorical column that puts every respondent in one group called label.
+    """
+    overall = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), categories=[label])
+    return pd.Series(overall, index=df.index)
+
+
+def get_dimension_codes(groups):
+    """
+    Return the group code of every respondent in a categorical dimension column, along with the list of groups.
+    """
+    return groups.cat.codes.to_numpy(dtype=np.int64), np.asarray(groups.cat.categories, dtype=object)
+
+
+def get_group_codes(values, groups):
+    """
+    Encode each value as its position in groups, with -1 for missing values and values not in groups.
+    """
+    return pd.Categorical(values, categories=np.asarray(groups)).codes.astype(np.int64)
+
+
+def count_by_group(group_codes, response_codes, group_total, response_total):
+    """
+    Count every (group, response) pair in a single pass and return the counts as a groups x responses array.
+    Pairs where either code is -1 are skipped.
+    """
+    valid = (group_codes >= 0) & (response_codes >= 0)
+    pairs = group_codes[valid] * response_total + response_codes[valid]
+    counts = np.bincount(pairs, minlength=group_total * response_total)
+    return counts.reshape(group_total, response_total)
+
+
+def get_section_groups(df, dimensions, labels):
+    """
+    Return the groups of each section label: the dimension column with that name, or a single group of every
+    respondent for the overall section's label.
+    """
+    return {label: dimensions[label] if label in dimensions.columns else get_overall_groups(df, label)
+            for label in labels}
 
-def get_region(df, respondent):
-    if 'US Region' in df.columns:
-        region = df.loc[respondent, 'US Region']
-        return region
-    elif 'UK Region' in df.columns:
-        subregion = df.loc[respondent, 'UK Region']
-        if subregion == 'London':
-            region = 'London'
-        elif (subregion == 'North East (England' or subregion == 'North West (England)'  # Pollfish mistake with )
-              or subregion == 'Yorkshire And The Humber'):
-            region = 'Northern England'
-        elif subregion == 'West Midlands (England)' or subregion == 'East Midlands (England)':
-            region = 'Midlands (England)'
-        elif (subregion == 'South East (England)' or subregion == 'East Of England'
-              or subregion == 'South West (England)'):
-            region = 'Southern England'
-        elif subregion == 'Scotland':
-            region = 'Scotland'
-        elif subregion == 'Wales':
-            region = 'Wales'
-        elif subregion == 'Northern Ireland':
-            region = 'Northern Ireland'
+
+def get_first_rows(df, codes, total):
+    """
+    Return the row of the sheet where each code from 0 to total - 1 first appears, counting from the top of the sheet
+    even when df is a later chunk of it. Codes that don't appear get sys.maxsize.
+    """
+    first_rows = np.full(total, sys.maxsize, dtype=np.int64)
+    found, positions = np.unique(codes, return_index=True)
+    first_rows[found[found >= 0]] = positions[found >= 0] + get_start_row(df)
+    return first_rows.tolist()
+
+
+def get_start_row(df):
+    """
+    Return the row of the sheet that df starts at, which is 0 unless df is a later chunk from read_csv_in_chunks.
+    """
+    return int(df.index[0]) if len(df) else 0
+
+
+def get_group_axis(df, groups):
+    """
+    Return the groups of a dimension column and their keys as a count table axis. Generations and regions from
+    REGION_HIERARCHY keep their listed order, and other groups are ordered by the row they first appear in, the same
+    order their list functions give for the whole sheet.
+    """
+    group_codes, group_list = get_dimension_codes(groups)
+    region_column = next((column for column in REGION_HIERARCHY if column in df.columns), None)
+    if groups.name == 'Generation' or (groups.name in REGION_LEVELS[1:]
+                                       and REGION_HIERARCHY.get(region_column) is not None):
+        return group_list, list(range(len(group_list)))
+
+    return group_list, get_first_rows(df, group_codes, len(group_list))
+
+
+def make_count_table(axes, counts):
+    """
+    Return a count table: an array of counts along with, for each axis of the array, a dict mapping each label to a
+    key that orders the labels (usually the row of the sheet where it first appears). Count tables from separate chunks
+    of the sheet can be added together with merge_counts and put in order with sort_count_table.
+    """
+    return {'axes': [dict(zip(labels, keys)) for labels, keys in axes], 'counts': np.asarray(counts)}
+
+
+def merge_counts(total, counts):
+    """
+    Add two count tables, or two dicts of them, lining up their labels and adding any labels only one of them has.
+    Either can be None. Merging is associative and the order of labels only depends on their keys, so chunks can be
+    merged in any order or grouping and give the same totals as counting the whole sheet.
+    """
+    if total is None:
+        return counts
+    elif counts is None:
+        return total
+    elif 'axes' not in total:
+        return {name: merge_counts(total.get(name), counts.get(name)) for name in {**total, **counts}}
+
+    axes = []
+    positions = []
+    for total_axis, axis in zip(total['axes'], counts['axes']):
+        merged_axis = dict(total_axis)
+        for label, key in axis.items():
+            merged_axis[label] = min(merged_axis[label], key) if label in merged_axis else key
+        label_positions = {label: position for position, label in enumerate(merged_axis)}
+        axes.append(merged_axis)
+        positions.append([label_positions[label] for label in axis])
+
+    # Pad the total out to the merged labels, then add the new counts at their labels' positions
+    merged = np.zeros([len(axis) for axis in axes], dtype=np.result_type(total['counts'], counts['counts']))
+    merged[tuple(slice(0, length) for length in total['counts'].shape)] = total['counts']
+    merged[np.ix_(*positions)] += counts['counts']
+
+    return {'axes': axes, 'counts': merged}
+
+
+def sort_count_table(table):
+    """
+    Return the labels of each axis of a count table in order of their keys, with the counts reordered to match.
+    Whole number labels are shown as floats if any label on the same axis is a float, as they are when a column with
+    missing values is loaded in one piece.
+    """
+    labels = []
+    counts = table['counts']
+
+    for axis_number, axis in enumerate(table['axes']):
+        axis_labels = list(axis)
+        keys = list(axis.values())
+        order = sorted(range(len(axis_labels)), key=keys.__getitem__)
+        if any(isinstance(label, (float, np.floating)) for label in axis_labels):
+            axis_labels = [float(label) if isinstance(label, (int, np.integer)) else label for label in axis_labels]
+
+        sorted_labels = np.empty(len(order), dtype=object)
+        sorted_labels[:] = [axis_labels[position] for position in order]
+        labels.append(sorted_labels)
+        counts = np.take(counts, order, axis=axis_number)
+
+    return labels, counts
+
+
+def stream_counts(filename, get_counts, question=None, chunksize=CHUNK_ROWS, field_date=None, generations=None):
+    """
+    Count a sheet too big to load in one piece, reading it chunksize rows at a time and merging the count tables that
+    get_counts returns for each chunk and its dimension table. Only the question's columns and the demographic
+    columns are read, and only the demographic columns if question is None.
+    """
+    accumulators = {'counts': (get_counts, question)}
+    return stream_all_counts(filename, accumulators, chunksize, field_date, generations)['counts']
+
+
+def export_in_chunks(import_name, module, question, filename, chunksize=CHUNK_ROWS, field_date=None):
+    """
+    Export a question from a raw data CSV too big to load in one piece, reading it chunksize rows at a time and merging
+    the counts from the question module's get_counts. The module's export_counts_to_csv writes the merged counts to
+    filename. For demographics, question is None and filename is the report folder.
+    """
+    counts = stream_counts(import_name, module.get_counts, question, chunksize, field_date)
+    return module.export_counts_to_csv(counts, filename)
+
+
+def stream_all_counts(filename, accumulators, chunksize=CHUNK_ROWS, field_date=None, generations=None):
+    """
+    Count several questions in a single pass over the sheet. accumulators maps a name to a (get_counts, question) pair,
+    where question is None for counts that only need the dimension table, such as demographics.get_counts. Each chunk
+    is read once, with the columns of every question, and its dimension table is shared by every accumulator. Returns
+    the merged counts under each name.
+    """
+    questions = [question for get_counts, question in accumulators.values() if question is not None]
+    totals = dict.fromkeys(accumulators)
+    warn_missing_field_date(get_csv_header(filename), field_date)
+
+    for chunk in read_csv_in_chunks(filename, questions, chunksize):
+        count_chunk(totals, chunk, accumulators, field_date, generations)
+    report_unmapped_regions(totals.get(UNMAPPED_REGIONS, {}))
+
+    return totals
+
+
+def count_chunk(totals, chunk, accumulators, field_date=None, generations=None):
+    """
+    Merge the counts of one chunk of the sheet into totals for every accumulator, sharing the chunk's dimension table.
+    The respondents left out of the region counts are merged into totals under UNMAPPED_REGIONS, to be reported once
+    for the whole sheet.
+    """
+    dimensions = get_dimension_table(chunk, field_date=field_date, generations=generations, report=False)
+    totals[UNMAPPED_REGIONS] = merge_counts(totals.get(UNMAPPED_REGIONS), get_unmapped_region_counts(chunk, dimensions))
+    for name, (get_counts, question) in accumulators.items():
+        if question is None:
+            counts = get_counts(chunk, dimensions)
         else:
-            region = None
-        return region
+            counts = get_counts(chunk, question, dimensions)
+        totals[name] = merge_counts(totals[name], counts)
+
+
+def update_all_counts(filename, accumulators, chunksize=CHUNK_ROWS, field_date=None, generations=None):
+    """
+    Count several questions like stream_all_counts, but only over the respondents added to the sheet since the last
+    run. The merged counts are saved next to the sheet with the number of rows and bytes of the file they cover, and
+    when the file still starts with exactly those bytes, only the rows after them are read and merged in. Any other
+    change to the file, the accumulators, the field date or the generations counts the whole sheet again, so the totals
+    are always the same as stream_all_counts gives.
+    """
+    settings = get_count_settings(accumulators, field_date, generations)
+    warn_missing_field_date(get_csv_header(filename), field_date)
+    counts_filename = f'{os.path.splitext(filename)[0]}-counts.pkl'
+    size = os.path.getsize(filename)
+
+    saved = pd.read_pickle(counts_filename) if os.path.exists(counts_filename) else None
+    if saved is not None and saved['settings'] == settings and saved['size'] <= size \
+            and get_file_hash(filename, saved['size']) == saved['hash']:
+        totals, rows, start = saved['totals'], saved['rows'], (saved['size'], saved['rows'])
+        print(f'Counting the respondents after the first {rows}')
     else:
+        totals, rows, start = dict.fromkeys(accumulators), 0, None
+
+    if start is None or start[0] < size:
+        questions = [question for get_counts, question in accumulators.values() if question is not None]
+        for chunk in read_csv_in_chunks(filename, questions, chunksize, start):
+            count_chunk(totals, chunk, accumulators, field_date, generations)
+            rows += len(chunk)
+    report_unmapped_regions(totals.get(UNMAPPED_REGIONS, {}))
+
+    pd.to_pickle({'settings': settings, 'size': size, 'hash': get_file_hash(filename, size), 'rows': rows,
+                  'totals': totals}, counts_filename)
+    return totals
+
+
+def get_count_settings(accumulators, field_date, generations=None):
+    """
+    Return what counts from a set of accumulators depend on besides the data, in a form json can write, so saved counts
+    are only reused or merged with counts made the same way.
+    """
+    return {'accumulators': [[name, f'{get_counts.__module__}.{get_counts.__name__}', question]
+                             for name, (get_counts, question) in accumulators.items()],
+            'field_date': None if field_date is None else field_date.isoformat(),
+            'generations': [[name, list(years)] for name, years in (generations or GENERATIONS).items()]}
+
+
+def split_csv_into_shards(filename, shard_rows, shard_folder):
+    """
+    Split a raw data CSV into shards of shard_rows rows each, with the sheet's header, so they can be counted on
+    separate processes or machines. Writes shards.json to the shard folder, listing each shard with the row of the
+    sheet it starts at, along with the types of the text columns of the whole sheet.
+    """
+    os.makedirs(shard_folder, exist_ok=True)
+    schema, _ = get_csv_schema(filename)
+    shards = []
+
+    with open(filename, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        shard_file = None
+        for row_number, row in enumerate(reader):
+            if row_number % shard_rows == 0:
+                if shard_file is not None:
+                    shard_file.close()
+                shards.append({'filename': f'{shard_folder}/raw-data-{row_number}.csv', 'first_row': row_number})
+                shard_file = open(shards[-1]['filename'], 'w', newline='')
+                writer = csv.writer(shard_file)
+                writer.writerow(header)
+            writer.writerow(row)
+        if shard_file is not None:
+            shard_file.close()
+
+    with open(f'{shard_folder}/shards.json', 'w') as f:
+        json.dump({'schema': {column: 'category' if dtype == 'category' else 'string'
+                              for column, dtype in schema.items()}, 'shards': shards}, f, indent=1)
+    return shards
+
+
+def get_shard_schema(shard_folder):
+    """
+    Return the types of the whole sheet's text columns saved by split_csv_into_shards, for read_csv_in_chunks.
+    """
+    with open(f'{shard_folder}/shards.json') as f:
+        schema = json.load(f)['schema']
+    return {column: 'category' if dtype == 'category' else TEXT_DTYPE for column, dtype in schema.items()}
+
+
+def count_shard(filename, accumulators, first_row=0, chunksize=CHUNK_ROWS, field_date=None, generations=None,
+                schema=None):
+    """
+    The map step of a sharded count: count a shard of the sheet, a CSV with the sheet's header and a run of its rows,
+    the same way stream_all_counts counts the whole sheet. first_row is the row of the sheet the shard starts at, so
+    labels are keyed as they are in the whole sheet and merging the shards gives exactly the same output. Returns the
+    partial counts, with the settings they were made with and the rows they cover.
+    """
+    questions = [question for get_counts, question in accumulators.values() if question is not None]
+    totals = dict.fromkeys(accumulators)
+    rows = 0
+
+    for chunk in read_csv_in_chunks(filename, questions, chunksize, schema=schema):
+        chunk.index += first_row
+        count_chunk(totals, chunk, accumulators, field_date, generations)
+        rows += len(chunk)
+
+    return {'settings': get_count_settings(accumulators, field_date, generations),
+            'rows': [[first_row, first_row + rows]], 'totals': totals}
+
+
+def merge_partial_counts(partials):
+    """
+    The reduce step of a sharded count: merge partial counts from count_shard, or from earlier merges, into one. Like
+    merge_counts this is associative, so partials can be merged in any grouping, but they must all have been counted
+    with the same settings and cover separate rows of the sheet.
+    """
+    merged = None
+    for partial in partials:
+        if merged is None:
+            merged = partial
+            continue
+        if partial['settings'] != merged['settings']:
+            print('Partial counts were made with different questions or settings and cannot be merged.')
+            sys.exit(1)
+
+        rows = sorted(merged['rows'] + partial['rows'])
+        if any(start < previous_end for (previous_start, previous_end), (start, end) in zip(rows, rows[1:])):
+            print('Partial counts cover some of the same rows and cannot be merged.')
+            sys.exit(1)
+        merged = {'settings': merged['settings'], 'rows': rows,
+                  'totals': merge_counts(merged['totals'], partial['totals'])}
+
+    return merged
+
+
+def get_json_value(value):
+    # Plain Python values for numpy scalars and tuples of them, which json can't write
+    if isinstance(value, tuple):
+        return [get_json_value(item) for item in value]
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def count_table_to_json(counts):
+    """
+    Convert a count table, or a dict of them, to lists and dicts json can write. Dicts become lists of (key, value)
+    pairs, so keys that aren't strings, such as question numbers, keep their type.
+    """
+    if counts is None:
         return None
+    elif 'axes' not in counts:
+        return {'items': [[get_json_value(name), count_table_to_json(value)] for name, value in counts.items()]}
+
+    axes = [[[get_json_value(label), get_json_value(key)] for label, key in axis.items()] for axis in counts['axes']]
+    return {'axes': axes,
+            'counts': counts['counts'].tolist(), 'shape': list(counts['counts'].shape),
+            'dtype': str(counts['counts'].dtype)}
+
+
+def count_table_from_json(counts):
+    """
+    Convert a count table, or a dict of them, back from count_table_to_json. json reads tuples as lists, so list keys,
+    such as the (row, position) keys of matrix statements, are turned back into tuples.
+    """
+    if counts is None:
+        return None
+    elif 'axes' not in counts:
+        return {name: count_table_from_json(value) for name, value in counts['items']}
+
+    axes = [{label: tuple(key) if isinstance(key, list) else key for label, key in axis} for axis in counts['axes']]
+    return {'axes': axes, 'counts': np.array(counts['counts'], dtype=counts['dtype']).reshape(counts['shape'])}
+
+
+def save_partial_counts(partial, filename):
+    """
+    Write partial counts from count_shard or merge_partial_counts to a JSON file, to send to the machine that merges
+    them.
+    """
+    with open(filename, 'w') as f:
+        json.dump({**partial, 'totals': count_table_to_json(partial['totals'])}, f)
+
+
+def load_partial_counts(filename):
+    with open(filename) as f:
+        partial = json.load(f)
+    return {**partial, 'totals': count_table_from_json(partial['totals'])}
+
+
+def get_first_appearance_codes(codes, labels):
+    """
+    Renumber codes into labels so labels are in order of their first appearance in codes, as pd.factorize orders them.
+    Returns the new codes and labels.
+    """
+    new_codes, order = pd.factorize(codes)
+    return new_codes, np.asarray(labels, dtype=object)[order]
+
+
+def parse_statement_cells(cells):
+    """
+    Split distinct "statement: value | ..." cells into their (statement, value) pairs, keeping the first value given for
+    each statement in a cell. Returns the cell of every pair, in cell order, the codes of its statement and value, and
+    the statements and values the codes index. The cells are parsed with pyarrow's string kernels when it's installed,
+    which is many times faster than pandas' string methods on the millions of pairs of a big rank question.
+    """
+    if pc is None:
+        items = pd.Series(np.asarray(cells, dtype=object)).str.split(' | ', regex=False).explode()
+        statements, separators, values = items.str.partition(':').values.T
+        pairs = pd.DataFrame({'Cell': items.index, 'Statement': statements, 'Separator': separators,
+                              'Response': values})
+        pairs = pairs[pairs['Separator'] == ':']
+        pairs['Statement'] = pairs['Statement'].str.strip()
+        pairs['Response'] = pairs['Response'].str.strip()
+        pairs = pairs.drop_duplicates(['Cell', 'Statement'])
+        statement_codes, statements = pd.factorize(pairs['Statement'].to_numpy())
+        response_codes, responses = pd.factorize(pairs['Response'].to_numpy())
+        return pairs['Cell'].to_numpy(dtype=np.int64), statement_codes, statements, response_codes, responses
+
+    # Split each cell into items, and each item at its first colon
+    items = pc.split_pattern(pyarrow.array(np.asarray(cells, dtype=object), type=pyarrow.string()), ' | ')
+    item_cells = pc.list_parent_indices(items).to_numpy()
+    parts = pc.split_pattern(pc.list_flatten(items), ':', max_splits=1)
+
+    # Encode every statement and value together, trimming only the distinct words, then drop items without a colon
+    words = pc.dictionary_encode(pc.list_flatten(parts))
+    word_codes, labels = pd.factorize(pc.utf8_trim_whitespace(words.dictionary).to_numpy(zero_copy_only=False))
+    word_codes = word_codes[words.indices.to_numpy()]
+    offsets = parts.offsets.to_numpy() - parts.offsets[0].as_py()
+    has_value = np.diff(offsets) == 2
+    statement_codes = word_codes[offsets[:-1][has_value]]
+    response_codes = word_codes[offsets[:-1][has_value] + 1]
+    item_cells = item_cells[has_value]
+
+    # Keep the first pair of each statement within a cell, in cell order. Repeats are rare, so pairs are only checked
+    # one by one when a count of every (cell, statement) finds any, or when there are too many to count
+    keys = item_cells * len(labels) + statement_codes
+    if len(cells) * len(labels) > 4 * len(keys) or np.bincount(keys).max(initial=0) > 1:
+        first_pairs = ~pd.Series(keys).duplicated().to_numpy()
+        item_cells, statement_codes, response_codes = (item_cells[first_pairs], statement_codes[first_pairs],
+                                                       response_codes[first_pairs])
+    return item_cells, statement_codes, labels, response_codes, labels
+
+
+def get_matrix_long_table(df, question):
+    """
+    Parse the "statement: value | ..." cells of a matrix or rank question once and return a long table with one row per
+    (respondent, statement, value). Respondent is the row position in df, and Statement and Response are categoricals
+    in order of first appearance, so every section can share the same parse.
+    """
+    column = get_question_column(df, question)
+    if column is None:
+        print('Question not available. Please check that the provided question is valid for this sheet.')
+        sys.exit(1)
+
+    # Parse each distinct cell only once, however many respondents gave the same answer
+    cell_codes, cells = pd.factorize(df[column])
+    if not len(cells):  # Nobody answered, which can happen within a chunk of the sheet
+        return pd.DataFrame({'Respondent': np.array([], dtype=np.int64),
+                             'Statement': pd.Categorical([], categories=[]),
+                             'Response': pd.Categorical([], categories=[])})
+    pair_cells, statement_codes, statements, response_codes, responses = parse_statement_cells(cells)
+
+    # Expand the parsed cells back out to every respondent who gave them
+    pair_counts = np.bincount(pair_cells, minlength=len(cells))
+    pair_starts = np.cumsum(pair_counts) - pair_counts
+    respondents = np.flatnonzero(cell_codes >= 0)
+    lengths = pair_counts[cell_codes[respondents]]
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    rows = np.repeat(pair_starts[cell_codes[respondents]], lengths) + offsets
+
+    statement_codes, statement_list = get_first_appearance_codes(statement_codes[rows], statements)
+    response_codes, response_list = get_first_appearance_codes(response_codes[rows], responses)
+    matrix = pd.DataFrame({'Respondent': np.repeat(respondents, lengths),
+                           'Statement': pd.Categorical.from_codes(statement_codes, statement_list),
+                           'Response': pd.Categorical.from_codes(response_codes, response_list)})
+
+    return matrix
 
 
 def write_section_to_csv(data, section_name, filename, mode='w'):
@@ -147,8 +1095,33 @@ def write_section_to_csv(data, section_name, filename, mode='w'):
                 f.write("\n")
             f.write(f"{section_name}\n")  # Write section name to CSV
             data.to_csv(f, index=False, header=True)  # Append data under section name
+        return True
     else:
         print(f"No {section_name.lower()} to write.")
+    return False
+
+
+def write_sections(sections, filename):
+    """
+    Write a dict of section title to DataFrame to filename, one section after another, and return it. The last run's
+    file is replaced by the first section that's actually written, and nothing is written if filename is None.
+    """
+    mode = 'w'
+    for section_name, data in sections.items():
+        if filename is not None and write_section_to_csv(data, section_name, filename, mode):
+            mode = 'a'
+
+    return sections
+
+
+def export_sections(section_titles, build_section, filename, sections=None):
+    """
+    Build every section in section_titles, a dict of section label to title, with build_section(label) and write
+    them with write_sections. If sections is given, only the sections with those titles are built and written.
+    """
+    built = {title: build_section(label) for label, title in section_titles.items()
+             if sections is None or title in sections}
+    return write_sections(built, filename)
 
 
 def export_data_to_csv(overall_data, gender_data, age_data, generation_data, education_data, region_data, filename):
@@ -156,10 +1129,7 @@ def export_data_to_csv(overall_data, gender_data, age_data, generation_data, edu
     Take the imported data, question, and export all required data to a new CSV with the corresponding filename,
     appending each section of the data to the file.
     """
-    write_section_to_csv(overall_data, 'Overall Data', filename, 'w')
-    write_section_to_csv(gender_data, 'Gender Data', filename, 'a')
-    write_section_to_csv(age_data, 'Age Data', filename, 'a')
-    write_section_to_csv(generation_data, 'Generation Data', filename, 'a')
-    write_section_to_csv(education_data, 'Education Data', filename, 'a')
-    write_section_to_csv(region_data, 'Region Data', filename, 'a')
+    sections = {'Overall Data': overall_data, 'Gender Data': gender_data, 'Age Data': age_data,
+                'Generation Data': generation_data, 'Education Data': education_data, 'Region Data': region_data}
+    write_sections(sections, filename)
 
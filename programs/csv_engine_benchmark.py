@@ -0,0 +1,91 @@
+import pandas as pd
+import numpy as np
+import os
+import time
+from cross_question_functions import *
+from gsheet_to_csv import write_gsheet_to_csv
+
+
+def get_synthetic_export(rows, question_total=40, seed=0):
+    """
+    Build a DataFrame laid out like a Pollfish export: demographic columns, then single-response, multiple-response
+    (one repeated header per option), matrix, rank, slider and free text questions in turn. Free text answers include
+    commas, quotes and line breaks, and some answers are left blank.
+    """
+    rng = np.random.default_rng(seed)
+    subregions = list(REGION_HIERARCHY['UK Region'])
+    statements = ['Pay', 'Hours', 'Culture', 'Growth']
+    importance = ['Very important', 'Somewhat important', 'Not important']
+
+    def blank(values, share=0.05):
+        values = np.array(values, dtype=object)
+        values[rng.random(rows) < share] = None
+        return values
+
+    columns = [('ID', np.arange(rows)),
+               ('Gender', rng.choice(['Male', 'Female', 'Non-binary'], rows, p=[0.48, 0.48, 0.04])),
+               ('Age', rng.integers(18, 80, rows)),
+               ('Education Level', rng.choice(['High school', 'University', 'Postgraduate', 'Vocational'], rows)),
+               ('UK Region', rng.choice(subregions, rows))]
+
+    for number in range(1, question_total + 1):
+        question = f'Q{number}: Synthetic question {number}?'
+        kind = number % 5
+        if kind == 0:
+            columns.append((question, blank(rng.choice(['Yes', 'No', 'Maybe', 'Not sure'], rows))))
+        elif kind == 1:
+            for _ in range(3):
+                columns.append((question, blank(rng.choice(['Apples', 'Pears', 'Plums', 'Kiwis'], rows), 0.5)))
+        elif kind == 2:
+            columns.append((question, blank([' | '.join(f'{statement}: {rng.choice(importance)}'
+                                                        for statement in statements) for _ in range(rows)])))
+        elif kind == 3:
+            columns.append((question, blank([' | '.join(f'{statement}:{rank + 1}' for rank, statement
+                                                        in enumerate(rng.permutation(statements)))
+                                             for _ in range(rows)])))
+        else:
+            columns.append((question, blank(rng.integers(0, 11, rows).astype(float))))
+            columns.append((f'{question} Comments', blank([f'Answer {i}, with "quotes"\nand a second line'
+                                                           for i in range(rows)], 0.3)))
+
+    df = pd.DataFrame({position: values for position, (name, values) in enumerate(columns)})
+    df.columns = [name for name, values in columns]  # Repeated headers, as in the Google Sheet
+    return df
+
+
+def time_load(filename, engine, repeats=3):
+    """
+    Returns the fastest of several uncached loads of a CSV with the given engine, along with the DataFrame.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        df = get_df_from_csv(filename, cache=False, engine=engine)
+        times.append(time.perf_counter() - start)
+    return min(times), df
+
+
+def benchmark_engines(filename, repeats=3):
+    """
+    Load the CSV with pandas' parser and with pyarrow, check both give the same dtypes and values, and print how long
+    each took.
+    """
+    c_time, c_df = time_load(filename, 'c', repeats)
+    arrow_time, arrow_df = time_load(filename, 'pyarrow', repeats)
+    pd.testing.assert_frame_equal(c_df, arrow_df)
+
+    print(f'{os.path.basename(filename)}: {len(c_df)} rows x {len(c_df.columns)} columns, '
+          f'c {c_time:.2f}s, pyarrow {arrow_time:.2f}s ({c_time / arrow_time:.1f}x), same dtypes and values')
+
+
+if __name__ == "__main__":
+    # Set variables for the benchmark
+    export_folder = '../csv_exports/benchmark'
+    row_counts = [10000, 100000, 500000]
+    question_total = 40
+
+    os.makedirs(export_folder, exist_ok=True)
+    for rows in row_counts:
+        export_name = f'{export_folder}/synthetic-{rows}.csv'
+        write_gsheet_to_csv(get_synthetic_export(rows, question_total), export_name)
+        benchmark_engines(export_name)
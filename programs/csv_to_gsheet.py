@@ -1,33 +1,47 @@
 import csv
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import pandas as pd
 import numpy as np
 import gspread
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from oauth2client.service_account import ServiceAccountCredentials
 
+KEY_FILE_PATH = '../my_credentials.json'
+SCOPE = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive.file',
+         'https://www.googleapis.com/auth/drive']
+VALUES_BATCH_CELLS = 100000  # Cells sent in each batched values request, keeping requests well under the size limit
+REQUESTS_PER_MINUTE = 60  # Sheets API write quota per user
+REQUEST_BURST = 10  # Requests that can be sent at once before pacing starts
+UPLOAD_WORKERS = 4  # Requests in flight at the same time
+RETRY_STATUSES = {429, 500, 502, 503}  # Quota and transient server errors worth retrying
+MAX_RETRIES = 6
+BACKOFF_SECONDS = 1  # Longest first wait after an error, doubled after each retry
+MAX_BACKOFF_SECONDS = 64
+GSHEET_STATE_FILE = '../csv_exports/gsheet-state.json'  # Fingerprint and values of every tab last pushed by a sync
+
+
 def preprocess_data(data):
     # Replace 'inf', '-inf' with a large finite number or another placeholder, and 'nan' with an empty string
     return data.replace([np.inf, -np.inf], np.nan).fillna('')
 
 
-def write_csv_to_gsheet(filename, gsheetkey, sheet_name):
+def get_gsheet_client(key_file_path=KEY_FILE_PATH):
     """
-    Takes a local CSV file and exports it to the designated Google Sheet under a new tab defined by sheet_name.
+    Authorize with the Google Sheets API, returning a client that can be shared by every export in a run.
     """
-    key_file_path = '../my_credentials.json'
-    scope = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive.file',
-             'https://www.googleapis.com/auth/drive']
+    creds = ServiceAccountCredentials.from_json_keyfile_name(key_file_path, SCOPE)
+    return gspread.authorize(creds)
 
-    # Authorize with Google Sheets API
-    creds = ServiceAccountCredentials.from_json_keyfile_name(key_file_path, scope)
-    client = gspread.authorize(creds)
 
-    # Access Google Sheet
-    sheet = client.open_by_key(gsheetkey)
-    try:
-        worksheet = sheet.worksheet(sheet_name)
-    except gspread.exceptions.WorksheetNotFound:
-        worksheet = sheet.add_worksheet(title=sheet_name, rows="100", cols="20")
-
-    # Read CSV file
+def read_csv_values(filename):
+    """
+    Read a local CSV file into a list of rows, padding rows with fewer columns than the longest row.
+    """
     with open(filename, "r") as f:
         reader = csv.reader(f)
         max_length = 0
@@ -41,24 +55,394 @@ def write_csv_to_gsheet(filename, gsheetkey, sheet_name):
         for row in values:
             row.extend([""] * (max_length - len(row)))
 
+    return values
+
+
+def get_sections_values(sections):
+    """
+    Lay out a dict of section title to DataFrame, as the exporters return them, in the stacked format
+    write_section_to_csv gives a CSV: each section's title, header and rows, with a blank row between sections, and
+    sections without data left out. NaN and inf are blanked as in preprocess_data, and every cell is a string, as
+    read_csv_values gives, so the values can go straight to the Sheets writers without a CSV in between.
+    """
+    values = []
+    for section_name, data in sections.items():
+        if not isinstance(data, pd.DataFrame) or data.empty:
+            continue
+        if values:
+            values.append([])
+        data = preprocess_data(data.astype(object))
+        values.append([section_name])
+        values.append([str(column) for column in data.columns])
+        values.extend([str(value) for value in row] for row in data.itertuples(index=False))
+
+    # Pad rows with fewer columns than the maximum
+    max_length = max((len(row) for row in values), default=0)
+    return [row + [''] * (max_length - len(row)) for row in values]
+
+
+def load_gsheet_state(state_filename=GSHEET_STATE_FILE):
+    if not os.path.exists(state_filename):
+        return {}
+    with open(state_filename) as f:
+        return json.load(f)
+
+
+def save_gsheet_state(state, state_filename=GSHEET_STATE_FILE):
+    with open(state_filename, 'w') as f:
+        json.dump(state, f)
+
+
+def forget_pushed_tabs(gsheetkey, sheet_names, state_filename=GSHEET_STATE_FILE):
+    """
+    Drop tabs that are about to be written in full from the values sync_to_gsheet last pushed, so the next sync reads
+    them back from the sheet instead of comparing with values the sheet no longer holds.
+    """
+    state = load_gsheet_state(state_filename)
+    pushed = state.get(gsheetkey, {})
+    if any(sheet_name in pushed for sheet_name in sheet_names):
+        for sheet_name in sheet_names:
+            pushed.pop(sheet_name, None)
+        save_gsheet_state(state, state_filename)
+
+
+def write_csv_to_gsheet(filename, gsheetkey, sheet_name, client=None, state_filename=GSHEET_STATE_FILE):
+    """
+    Takes a local CSV file and exports it to the designated Google Sheet under a new tab defined by sheet_name.
+    """
+    if client is None:
+        client = get_gsheet_client()
+    forget_pushed_tabs(gsheetkey, [sheet_name], state_filename)
+
+    # Access Google Sheet
+    sheet = client.open_by_key(gsheetkey)
+    try:
+        worksheet = sheet.worksheet(sheet_name)
+    except gspread.exceptions.WorksheetNotFound:
+        worksheet = sheet.add_worksheet(title=sheet_name, rows="100", cols="20")
+
     # Updating the Google Sheet CSV data starting at 'A1'
-    worksheet.update('A1', values, value_input_option='USER_ENTERED')
+    worksheet.update('A1', read_csv_values(filename), value_input_option='USER_ENTERED')
 
     print(f"Data successfully written to {sheet_name} in Google Sheet with key {gsheetkey}")
 
 
+def get_tab_range(sheet_name, cell='A1'):
+    # Quote the tab name for A1 notation, doubling any quotes in it, with no cell for the whole tab
+    tab = "'" + sheet_name.replace("'", "''") + "'"
+    return tab if cell is None else f'{tab}!{cell}'
+
+
+def get_tab_requests(metadata, tabs):
+    """
+    Return the batch_update requests that add each missing tab at the size of its values, and grow existing tabs too
+    small for theirs, given the spreadsheet's metadata and a dict of tab name to values.
+    """
+    existing = {sheet['properties']['title']: sheet['properties'] for sheet in metadata['sheets']}
+    requests = []
+
+    for sheet_name, values in tabs.items():
+        rows = max(len(values), 1)
+        cols = max(max((len(row) for row in values), default=0), 1)
+        if sheet_name not in existing:
+            requests.append({'addSheet': {'properties': {
+                'title': sheet_name, 'gridProperties': {'rowCount': rows, 'columnCount': cols}}}})
+            continue
+
+        grid = existing[sheet_name]['gridProperties']
+        if grid['rowCount'] < rows or grid['columnCount'] < cols:
+            requests.append({'updateSheetProperties': {
+                'properties': {'sheetId': existing[sheet_name]['sheetId'],
+                               'gridProperties': {'rowCount': max(grid['rowCount'], rows),
+                                                  'columnCount': max(grid['columnCount'], cols)}},
+                'fields': 'gridProperties(rowCount,columnCount)'}})
+
+    return requests
+
+
+def get_tab_batches(tabs, batch_cells=VALUES_BATCH_CELLS):
+    """
+    Split a dict of tab name to values into dicts of about batch_cells cells each, one per values request. A tab is
+    never split, so a tab bigger than batch_cells is sent in a request of its own.
+    """
+    batches = []
+    batch = {}
+    cells = 0
+
+    for sheet_name, values in tabs.items():
+        tab_cells = sum(len(row) for row in values)
+        if batch and cells + tab_cells > batch_cells:
+            batches.append(batch)
+            batch = {}
+            cells = 0
+        batch[sheet_name] = values
+        cells += tab_cells
+
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def get_ranges_body(ranges):
+    return {'valueInputOption': 'USER_ENTERED',
+            'data': [{'range': cell_range, 'values': values} for cell_range, values in ranges.items()]}
+
+
+def get_values_body(tabs):
+    return get_ranges_body({get_tab_range(sheet_name): values for sheet_name, values in tabs.items()})
+
+
+def make_rate_limiter(requests_per_minute=REQUESTS_PER_MINUTE, burst=REQUEST_BURST):
+    """
+    Return a token bucket shared by every thread of an upload: it holds up to burst tokens, refilled at
+    requests_per_minute, and each request takes one.
+    """
+    return {'rate': requests_per_minute / 60, 'capacity': burst, 'tokens': burst, 'updated': time.monotonic(),
+            'lock': threading.Lock()}
+
+
+def wait_for_request(limiter):
+    """
+    Block until the rate limiter has a token for a request, and take it.
+    """
+    while True:
+        with limiter['lock']:
+            now = time.monotonic()
+            limiter['tokens'] = min(limiter['capacity'],
+                                    limiter['tokens'] + (now - limiter['updated']) * limiter['rate'])
+            limiter['updated'] = now
+            if limiter['tokens'] >= 1:
+                limiter['tokens'] -= 1
+                return
+            wait = (1 - limiter['tokens']) / limiter['rate']
+        time.sleep(wait)
+
+
+def send_request(limiter, request, *args, backoff=BACKOFF_SECONDS):
+    """
+    Call request(*args) once the rate limiter allows it, retrying quota and transient server errors up to MAX_RETRIES
+    times. Each retry waits a random time of up to backoff seconds, doubled after every retry, so threads that hit the
+    quota together don't all retry together. A quota error also empties the rate limiter, slowing every other thread.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        if limiter is not None:
+            wait_for_request(limiter)
+        try:
+            return request(*args)
+        except gspread.exceptions.APIError as error:
+            status = error.response.status_code
+            if status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                raise
+            if status == 429 and limiter is not None:
+                with limiter['lock']:
+                    limiter['tokens'] = min(limiter['tokens'], 0)
+            time.sleep(random.uniform(0, min(MAX_BACKOFF_SECONDS, backoff * 2 ** attempt)))
+
+
+def prepare_gsheet(client, gsheetkey, tabs, limiter=None, backoff=BACKOFF_SECONDS):
+    """
+    Open the designated Google Sheet and add and size the tabs for a dict of tab name to values, in one request for
+    the spreadsheet's tabs and one to change them. Returns the spreadsheet.
+    """
+    spreadsheet = send_request(limiter, client.open_by_key, gsheetkey, backoff=backoff)
+    requests = get_tab_requests(send_request(limiter, spreadsheet.fetch_sheet_metadata, backoff=backoff), tabs)
+    if requests:
+        send_request(limiter, spreadsheet.batch_update, {'requests': requests}, backoff=backoff)
+    return spreadsheet
+
+
+def write_values_to_gsheet(tabs, gsheetkey, client=None, state_filename=GSHEET_STATE_FILE):
+    """
+    Write a dict of tab name to rows of values to the designated Google Sheet in a handful of requests: one for the
+    spreadsheet's tabs, one to add and size every tab, and one values request per VALUES_BATCH_CELLS cells.
+    """
+    if client is None:
+        client = get_gsheet_client()
+    forget_pushed_tabs(gsheetkey, list(tabs), state_filename)
+
+    spreadsheet = prepare_gsheet(client, gsheetkey, tabs)
+    for batch in get_tab_batches(tabs):
+        send_request(None, spreadsheet.values_batch_update, get_values_body(batch))
+
+    print(f"Data successfully written to {len(tabs)} tabs in Google Sheet with key {gsheetkey}")
+
+
+def upload_to_gsheets(uploads, client=None, requests_per_minute=REQUESTS_PER_MINUTE, workers=UPLOAD_WORKERS,
+                      backoff=BACKOFF_SECONDS, state_filename=GSHEET_STATE_FILE):
+    """
+    Upload to several Google Sheets at once, given a dict of spreadsheet key to a dict of tab name to values. Up to
+    workers requests are in flight at a time, paced to requests_per_minute between them, and errors are retried with
+    backoff. Every spreadsheet's tabs are added and sized first, then the values batches of all spreadsheets are sent.
+
+    Returns the tabs that still failed, in the same layout as uploads, so passing them back in resumes the upload
+    without resending tabs that were written.
+    """
+    if client is None:
+        client = get_gsheet_client()
+    for gsheetkey, tabs in uploads.items():
+        forget_pushed_tabs(gsheetkey, list(tabs), state_filename)
+    limiter = make_rate_limiter(requests_per_minute)
+    failed = {}
+
+    with ThreadPoolExecutor(workers) as executor:
+        futures = {executor.submit(prepare_gsheet, client, gsheetkey, tabs, limiter, backoff): gsheetkey
+                   for gsheetkey, tabs in uploads.items()}
+        spreadsheets = {}
+        for future in as_completed(futures):
+            gsheetkey = futures[future]
+            try:
+                spreadsheets[gsheetkey] = future.result()
+            except (gspread.exceptions.APIError, OSError) as error:
+                print(f"Couldn't prepare the tabs of Google Sheet with key {gsheetkey}: {error}")
+                failed[gsheetkey] = dict(uploads[gsheetkey])
+
+        futures = {executor.submit(send_request, limiter, spreadsheet.values_batch_update, get_values_body(batch),
+                                   backoff=backoff): (gsheetkey, batch)
+                   for gsheetkey, spreadsheet in spreadsheets.items() for batch in get_tab_batches(uploads[gsheetkey])}
+        for future in as_completed(futures):
+            gsheetkey, batch = futures[future]
+            try:
+                future.result()
+            except (gspread.exceptions.APIError, OSError) as error:
+                print(f"Couldn't write {', '.join(batch)} to Google Sheet with key {gsheetkey}: {error}")
+                failed.setdefault(gsheetkey, {}).update(batch)
+
+    written = sum(len(tabs) for tabs in uploads.values()) - sum(len(tabs) for tabs in failed.values())
+    print(f"Data successfully written to {written} tabs in {len(uploads)} Google Sheets, "
+          f"{len(failed)} with failed tabs")
+    return failed
+
+
+def write_csvs_to_gsheet(files, gsheetkey, client=None, state_filename=GSHEET_STATE_FILE):
+    """
+    Takes a dict of tab name to local CSV file and exports every file to its tab of the designated Google Sheet,
+    authorizing once and batching the requests with write_values_to_gsheet.
+    """
+    tabs = {sheet_name: read_csv_values(filename) for sheet_name, filename in files.items()}
+    write_values_to_gsheet(tabs, gsheetkey, client, state_filename)
+
+
+def get_values_fingerprint(values):
+    return hashlib.blake2b(json.dumps(values).encode(), digest_size=16).hexdigest()
+
+
+def pad_values(values, rows, cols):
+    # Square off rows of values to rows x cols with blank cells
+    return [list(row) + [''] * (cols - len(row)) for row in values] + [[''] * cols] * (rows - len(values))
+
+
+def get_changed_ranges(sheet_name, old_values, new_values):
+    """
+    Compare the values last pushed to a tab with its new values and return the ranges to write, as a dict of A1 range
+    to values. Each run of changed rows is written as one block, from its first to last changed column. Cells the new
+    values no longer reach are blanked.
+    """
+    rows = max(len(old_values), len(new_values))
+    cols = max([len(row) for row in old_values + new_values], default=0)
+    old_values = pad_values(old_values, rows, cols)
+    new_values = pad_values(new_values, rows, cols)
+
+    changed_rows = [row for row in range(rows) if old_values[row] != new_values[row]]
+    ranges = {}
+    start = 0
+    while start < len(changed_rows):
+        # Extend the run while the next changed row directly follows
+        end = start
+        while end + 1 < len(changed_rows) and changed_rows[end + 1] == changed_rows[end] + 1:
+            end += 1
+        run = range(changed_rows[start], changed_rows[end] + 1)
+        changed_cols = [col for col in range(cols) if any(old_values[row][col] != new_values[row][col] for row in run)]
+        first_col, last_col = changed_cols[0], changed_cols[-1]
+
+        cell = gspread.utils.rowcol_to_a1(run[0] + 1, first_col + 1)
+        ranges[get_tab_range(sheet_name, cell)] = [new_values[row][first_col:last_col + 1] for row in run]
+        start = end + 1
+
+    return ranges
+
+
+def read_back_values(spreadsheet, sheet_names, backoff=BACKOFF_SECONDS):
+    """
+    Read the current values of several tabs in one request, as a dict of tab name to rows of strings.
+    """
+    ranges = [get_tab_range(sheet_name, None) for sheet_name in sheet_names]
+    response = send_request(None, spreadsheet.values_batch_get, ranges, {'valueRenderOption': 'FORMULA'},
+                            backoff=backoff)
+    return {sheet_name: [[str(value) for value in row] for row in value_range.get('values', [])]
+            for sheet_name, value_range in zip(sheet_names, response['valueRanges'])}
+
+
+def sync_to_gsheet(tabs, gsheetkey, client=None, state_filename=GSHEET_STATE_FILE, read_back=False):
+    """
+    Write only what changed since the last sync to the designated Google Sheet, given a dict of tab name to values.
+
+    Each tab's fingerprint is compared with the one saved in state_filename when it was last pushed, and unchanged
+    tabs aren't sent at all, so a rerun with no changes makes no requests. Changed tabs are compared with the values
+    last pushed, or with the values read back from the sheet for tabs the state doesn't know or when read_back is set,
+    and only the changed ranges are written, in as few values requests as VALUES_BATCH_CELLS allows.
+    """
+    state = load_gsheet_state(state_filename)
+    pushed = state.setdefault(gsheetkey, {})
+
+    fingerprints = {sheet_name: get_values_fingerprint(values) for sheet_name, values in tabs.items()}
+    changed = {sheet_name: values for sheet_name, values in tabs.items()
+               if read_back or pushed.get(sheet_name, {}).get('fingerprint') != fingerprints[sheet_name]}
+    if not changed:
+        print(f"All {len(tabs)} tabs are up to date in Google Sheet with key {gsheetkey}")
+        return
+
+    if client is None:
+        client = get_gsheet_client()
+    spreadsheet = send_request(None, client.open_by_key, gsheetkey)
+    metadata = send_request(None, spreadsheet.fetch_sheet_metadata)
+    existing = {sheet['properties']['title'] for sheet in metadata['sheets']}
+
+    # Read back the tabs already in the sheet that there's nothing saved for, and start new tabs blank, even when
+    # values were saved for them before the tab was deleted
+    old_values = {sheet_name: pushed[sheet_name]['values'] for sheet_name in changed
+                  if sheet_name in pushed and sheet_name in existing and not read_back}
+    unknown = [sheet_name for sheet_name in changed if sheet_name not in old_values and sheet_name in existing]
+    if unknown:
+        old_values.update(read_back_values(spreadsheet, unknown))
+
+    requests = get_tab_requests(metadata, changed)
+    if requests:
+        send_request(None, spreadsheet.batch_update, {'requests': requests})
+
+    ranges = {}
+    for sheet_name, values in changed.items():
+        ranges.update(get_changed_ranges(sheet_name, old_values.get(sheet_name, []), values))
+    for batch in get_tab_batches(ranges):
+        send_request(None, spreadsheet.values_batch_update, get_ranges_body(batch))
+
+    for sheet_name, values in changed.items():
+        pushed[sheet_name] = {'fingerprint': fingerprints[sheet_name], 'values': values}
+    save_gsheet_state(state, state_filename)
+
+    print(f"Data successfully synced to {len(changed)} of {len(tabs)} tabs in Google Sheet with key {gsheetkey}, "
+          f"{len(ranges)} ranges written")
+
+
 if __name__ == "__main__":
-    # Set constants for this survey
-    gsheetkey = '1p3z3WnzGesafG7se-6eJn5vfGaiErQiq_VHOz0Iu8hU'
-    report_folder = 'rg-2025-q2'
+    # Set the Google Sheet of each report folder
+    reports = {'rg-2025-q2': '1p3z3WnzGesafG7se-6eJn5vfGaiErQiq_VHOz0Iu8hU'}
+    attempts = 3  # Times to try failed tabs again
+    sync = True  # Only write the tabs and cells that changed since the last sync
 
     # Export all survey data to Google Sheet
-    for num in range(3,17):
-        filename = f'Question {num}'
-        filepath = f'../csv_exports/{report_folder}/{filename}.csv'
-        sheet_name = filename
-        write_csv_to_gsheet(filepath, gsheetkey, sheet_name)
-
-    # Write demographics to GSheet
-#    demographics_filepath = f'../csv_exports/{report_folder}/demographics.csv'
-#    write_csv_to_gsheet(demographics_filepath, gsheetkey, 'Demographics')
+    uploads = {}
+    for report_folder, gsheetkey in reports.items():
+        files = {f'Question {num}': f'../csv_exports/{report_folder}/Question {num}.csv' for num in range(3, 17)}
+        # files['Demographics'] = f'../csv_exports/{report_folder}/demographics.csv'
+        uploads.setdefault(gsheetkey, {}).update({sheet_name: read_csv_values(filename)
+                                                  for sheet_name, filename in files.items()})
+
+    client = get_gsheet_client()
+    if sync:
+        for gsheetkey, tabs in uploads.items():
+            sync_to_gsheet(tabs, gsheetkey, client)
+    else:
+        for attempt in range(attempts):
+            uploads = upload_to_gsheets(uploads, client)
+            if not uploads:
+                break
@@ -1,107 +1,118 @@
 import pandas as pd
-import datetime
+import numpy as np
 from cross_question_functions import *
 
+# Label and dimension column of each section, in the order they're written
+SECTIONS = {'Gender': 'Gender', 'Age': 'Age', 'Generation': 'Generation', 'Education': 'Education',
+            'Region': 'Subregion'}
 
-def get_gender_counts(df):
-    if 'Gender' in df.columns:
-        gender_counts = df['Gender'].dropna().value_counts()
-        return gender_counts
-    else:
-        return pd.Series(dtype=int)
 
+def get_gender_counts(df, dimensions=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    gender_counts = dimensions['Gender'].value_counts()
+    return gender_counts
 
-def get_age_counts(df):
-    if 'Age' in df.columns:
-        age_counts = df['Age'].dropna().value_counts()
-        return age_counts
-    else:
-        return pd.Series(dtype=int)
 
+def get_age_counts(df, dimensions=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    age_counts = dimensions['Age'].value_counts()
+    return age_counts
 
-def get_generation_counts(df):
-    if 'Year Of Birth' not in df.columns and 'Age' not in df.columns:
-        return None
 
-    generation_counts = {'Gen Z': 0, 'Millennial': 0, 'Gen X': 0, 'Baby Boomer': 0}
-    current_year = datetime.datetime.now().year
+def get_generation_counts(df, dimensions=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    generation_counts = dimensions['Generation'].value_counts(sort=False)
+    return generation_counts
 
-    if 'Year Of Birth' in df.columns:
-        year_counts = df['Year Of Birth'].dropna().value_counts()
-        generation_counts = {'Gen Z': 0, 'Millennial': 0, 'Gen X': 0, 'Baby Boomer': 0}
-        for year, count in year_counts.items():
-            if 1997 <= year <= 2012:
-                generation_counts['Gen Z'] += count
-            elif 1981 <= year <= 1996:
-                generation_counts['Millennial'] += count
-            elif 1965 <= year <= 1980:
-                generation_counts['Gen X'] += count
-            elif 1946 <= year <= 1964:
-                generation_counts['Baby Boomer'] += count
 
-    elif 'Age' in df.columns:
-        age_counts = df['Age'].dropna().value_counts()
-        for age, count in age_counts.items():
-            birth_year = current_year - age
-            if 1997 <= birth_year <= 2012:
-                generation_counts['Gen Z'] += count
-            elif 1981 <= birth_year <= 1996:
-                generation_counts['Millennial'] += count
-            elif 1965 <= birth_year <= 1980:
-                generation_counts['Gen X'] += count
-            elif 1946 <= birth_year <= 1964:
-                generation_counts['Baby Boomer'] += count
+def get_region_counts(df, dimensions=None, level='Subregion'):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    region_counts = dimensions[level].value_counts()
+    return region_counts
 
-    else:
-        return None
 
-    return pd.Series(generation_counts)
+def get_education_counts(df, dimensions=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    education_counts = dimensions['Education'].value_counts()
+    return education_counts
 
 
-def get_region_counts(df):
-    if 'US Region' in df.columns:
-        region_counts = df['US Region'].dropna().value_counts()
-        return region_counts
-    if 'UK Region' in df.columns:
-        region_counts = df['UK Region'].dropna().value_counts()
-        return region_counts
-    else:
-        return pd.Series(dtype=int)
+def export_data_to_csv(df, report_folder, dimensions=None):
+    """
+    Export the respondents in each group of every section to demographics.csv in the report folder. Always returns the
+    sections as a dict of title to DataFrame, and with a report_folder of None nothing is written.
+    """
+    filename = f'../csv_exports/{report_folder}/demographics.csv' if report_folder is not None else None
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
 
+    section_counts = {'Gender': get_gender_counts(df, dimensions), 'Age': get_age_counts(df, dimensions),
+                      'Generation': get_generation_counts(df, dimensions),
+                      'Education': get_education_counts(df, dimensions), 'Region': get_region_counts(df, dimensions)}
+    written = {}
+    for section_name, group_counts in section_counts.items():
+        written[section_name] = group_counts.rename_axis(section_name).reset_index(name='Count')
+        print(group_counts)
 
-def get_education_counts(df):
-    if 'Education Level' in df.columns:
-        education_counts = df['Education Level'].dropna().value_counts()
-        return education_counts
-    else:
-        return pd.Series(dtype=int)
+    return write_sections(written, filename)
 
 
-def export_data_to_csv(df, report_folder):
-    filename = f'../csv_exports/{report_folder}/demographics.csv'
+def get_counts(df, dimensions=None):
+    """
+    Count the respondents in each group of every section as count tables, which merge_counts can add up across chunks
+    of the sheet.
+    """
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
 
-    write_section_to_csv(get_gender_counts(df).rename_axis('Gender').reset_index(name='Count'), 'Gender', filename, 'w')
-    print(get_gender_counts(df))
+    counts = {}
+    for label, column in SECTIONS.items():
+        group_codes, group_list = get_dimension_codes(dimensions[column])
+        group_counts = np.bincount(group_codes[group_codes >= 0], minlength=len(group_list))
+        counts[label] = make_count_table([get_group_axis(df, dimensions[column])], group_counts)
 
-    write_section_to_csv(get_age_counts(df).rename_axis('Age').reset_index(name='Count'), 'Age', filename, 'a')
-    print(get_age_counts(df))
+    return counts
 
-    write_section_to_csv(get_generation_counts(df).rename_axis('Generation').reset_index(name='Count'), 'Generation', filename, 'a')
-    print(get_generation_counts(df))
 
-    write_section_to_csv(get_education_counts(df).rename_axis('Education').reset_index(name='Count'), 'Education',
-                         filename, 'a')
-    print(get_education_counts(df))
+def get_counts_from_table(table, sort=True):
+    """
+    Return the counts of a merged count table from get_counts as a Series, largest first unless sort is False, the way
+    value_counts gives them for the whole sheet.
+    """
+    (group_list,), group_counts = sort_count_table(table)
+    group_counts = pd.Series(group_counts, index=pd.Index(group_list, dtype=object), name='count')
+    if sort:
+        group_counts = group_counts.sort_values(ascending=False, kind='stable')
+    return group_counts
 
-    write_section_to_csv(get_region_counts(df).rename_axis('Region').reset_index(name='Count'), 'Region', filename, 'a')
-    print(get_region_counts(df))
+
+def export_counts_to_csv(counts, report_folder):
+    """
+    Write counts from get_counts, merged over the whole sheet, and return them the same way as export_data_to_csv.
+    """
+    filename = f'../csv_exports/{report_folder}/demographics.csv' if report_folder is not None else None
+
+    written = {}
+    for label in SECTIONS:
+        group_counts = get_counts_from_table(counts[label], sort=label != 'Generation')
+        written[label] = group_counts.rename_axis(label).reset_index(name='Count')
+        print(group_counts)
+
+    return write_sections(written, filename)
 
 
 if __name__ == "__main__":
     # Set variables for analysis
     report_folder = 'rg-2025-q2'
+    field_date = None  # Date the survey was in field (datetime.date), needed for generations when there's only an age
 
     # Export data to CSV
     import_data_name = f'../csv_exports/{report_folder}/raw-data.csv'
-    data_frame = get_df_from_csv(import_data_name)
-    export_data_to_csv(data_frame, report_folder)
+    data_frame = get_df_from_csv(import_data_name, questions=[])  # Only the demographic columns are needed
+    dimensions = get_dimension_table(data_frame, import_data_name, field_date)
+    export_data_to_csv(data_frame, report_folder, dimensions)
@@ -0,0 +1,149 @@
+import pandas as pd
+import json
+import os
+import re
+import time
+from cross_question_functions import *
+
+DETECTION_SAMPLE_ROWS = 1000  # Rows sampled from the top of the sheet to tell question types apart
+MATRIX_CELL_SHARE = 0.9  # Share of distinct answers that must be "statement: value | ..." cells for matrix and rank
+FREE_TEXT_MIN_ANSWERS = 20  # Answers needed in the sample before a question with mostly distinct answers is free text
+
+
+def get_question_groups(header):
+    """
+    Group the positions of the sheet's question columns, whose headers start with "Q<number>: ", by header in sheet
+    order. Repeated headers, numbered 'text.1', 'text.2', ... by pandas, are grouped with the first one. Returns the
+    question number, text and column positions of each group.
+    """
+    column_names = set(header)
+    groups = {}
+    for position, column in enumerate(header):
+        question_text = re.sub(r'\.\d+$', '', str(column))
+        if question_text not in column_names:
+            question_text = column
+        question_number = re.match(r'Q(\d+): ?(.*)', question_text, re.DOTALL)
+        if question_number:
+            groups.setdefault(question_text, (int(question_number.group(1)), question_number.group(2), []))
+            groups[question_text][2].append(position)
+
+    return list(groups.values())
+
+
+def is_statement_cells(cells):
+    """
+    Check whether most distinct answers are "statement: value | statement: value" cells, as matrix and rank questions
+    are exported.
+    """
+    statement_cells = sum(all(':' in pair for pair in cell.split(' | ')) for cell in cells)
+    return statement_cells >= MATRIX_CELL_SHARE * len(cells)
+
+
+def is_rank_cells(cells):
+    """
+    Check whether every statement in every cell has a whole number value, with each cell ranking its statements
+    1, 2, ..., n without gaps or ties.
+    """
+    for cell in cells:
+        values = [pair.partition(':')[2].strip() for pair in cell.split(' | ')]
+        if not all(value.isdigit() for value in values):
+            return False
+        if sorted(int(value) for value in values) != list(range(1, len(values) + 1)):
+            return False
+    return True
+
+
+def is_number(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def detect_question_type(sample, positions):
+    """
+    Return the type of a question from a sample of its columns, or None for free text and questions nobody answered
+    in the sample:
+    - multiple: the question has several columns, one per option
+    - matrix or rank: answers are "statement: value" cells, with rank values numbering the statements 1 to n
+    - slider: every answer is a number
+    - single: anything else with few enough distinct answers
+    """
+    if len(positions) > 1:
+        return 'multiple'
+
+    # Only the distinct answers are checked, which keeps this quick however many rows are sampled
+    column = sample.iloc[:, positions[0]].to_numpy(dtype=object)
+    answers = [answer for answer in (str(value).strip() for value in column[pd.notna(column)]) if answer]
+    if not answers:
+        return None
+    cells = set(answers)
+
+    if is_statement_cells(cells):
+        return 'rank' if is_rank_cells(cells) else 'matrix'
+    elif all(is_number(cell) for cell in cells):
+        return 'slider'
+    elif len(answers) >= FREE_TEXT_MIN_ANSWERS and len(cells) > CATEGORY_RATIO * len(answers):
+        return None
+    return 'single'
+
+
+def detect_manifest(filename, sample_rows=DETECTION_SAMPLE_ROWS, field_date=None):
+    """
+    Detect the type of every numbered question in a raw data CSV from a sample of its rows and return a manifest that
+    routes each one to its module, in the layout get_manifest reads. Free text questions, questions nobody answered in
+    the sample and later questions that repeat a number, such as a comments column, are left out.
+    """
+    header = get_csv_header(filename)
+    groups = get_question_groups(header)
+    columns = sorted(position for number, text, positions in groups for position in positions)
+    sample = pd.read_csv(filename, header=0, names=header, usecols=columns, nrows=sample_rows, dtype=str)
+    positions_in_sample = {position: number for number, position in enumerate(columns)}
+
+    manifest = {'questions': []}
+    if field_date is not None:
+        manifest['field_date'] = field_date.isoformat()
+
+    numbers = set()
+    for number, text, positions in groups:
+        question_type = detect_question_type(sample, [positions_in_sample[position] for position in positions])
+        if question_type is None:
+            print(f'Skipping Q{number}: {text} (free text or no answers in the sample)')
+        elif number in numbers:  # Each number has one Question <number>.csv, so only its first question is exported
+            print(f'Skipping Q{number}: {text} (another question already has this number)')
+        else:
+            numbers.add(number)
+            manifest['questions'].append({'number': number, 'type': question_type, 'text': text})
+
+    return manifest
+
+
+def write_manifest(manifest, report_folder):
+    """
+    Write a manifest to ../csv_exports/<report_folder>/manifest.json, one question per line so it's easy to check and
+    correct by hand.
+    """
+    lines = [f'    {json.dumps(entry, ensure_ascii=False)}' for entry in manifest['questions']]
+    settings = ''.join(f'  {json.dumps(key)}: {json.dumps(value)},\n' for key, value in manifest.items()
+                       if key != 'questions')
+    with open(f'../csv_exports/{report_folder}/manifest.json', 'w') as f:
+        f.write('{\n' + settings + '  "questions": [\n' + ',\n'.join(lines) + '\n  ]\n}\n')
+
+
+if __name__ == "__main__":
+    # Set variables for analysis
+    report_folder = 'rg-2025-q2'
+    field_date = None  # Date the survey was in field (datetime.date), needed for generations when there's only an age
+
+    start = time.perf_counter()
+    manifest = detect_manifest(f'../csv_exports/{report_folder}/raw-data.csv', field_date=field_date)
+    for entry in manifest['questions']:
+        print(f'Q{entry["number"]}: {entry["type"]}')
+    print(f'Detected {len(manifest["questions"])} questions in {time.perf_counter() - start:.2f}s')
+    warn_missing_field_date(get_csv_header(f'../csv_exports/{report_folder}/raw-data.csv'), field_date)
+
+    if os.path.exists(f'../csv_exports/{report_folder}/manifest.json'):
+        print('manifest.json already exists, so it was left as it is.')
+    else:
+        write_manifest(manifest, report_folder)
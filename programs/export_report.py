@@ -0,0 +1,341 @@
+import pandas as pd
+import datetime
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from cross_question_functions import *
+import demographics
+from csv_to_gsheet import get_sections_values, sync_to_gsheet
+from detect_questions import detect_manifest, write_manifest
+import matrix
+import multiple_response
+import rank
+import singe_response
+import slider
+
+# Module that exports each type of question in a manifest
+QUESTION_TYPES = {
+    'single': singe_response,
+    'multiple': multiple_response,
+    'matrix': matrix,
+    'rank': rank,
+    'slider': slider,
+}
+
+# The raw data and dimension table of a worker process, loaded once by start_worker
+WORKER_DATA = {}
+
+
+def get_manifest(report_folder):
+    """
+    Read the manifest of a report folder, ../csv_exports/<report_folder>/manifest.json, which lists the questions to
+    export. For example:
+
+    {
+        "field_date": "2025-06-02",
+        "demographics": true,
+        "questions": [
+            {"number": 4, "type": "multiple", "text": "Have you ever presented AI-generated work as your own?"},
+            {"number": 15, "type": "single", "text": "Do you have a side hustle?", "sections": ["Overall", "Gender"]}
+        ]
+    }
+
+    Each question's type is one of QUESTION_TYPES. Sections is optional and names the sections to write (Overall,
+    Gender, Age, Generation, Education or Region), with every section the type supports written by default. The field
+    date is optional and used for birth years when there's only an age.
+
+    If the folder has no manifest, the question types are detected from the raw data and the manifest is written so it
+    can be checked and corrected.
+    """
+    manifest_name = f'../csv_exports/{report_folder}/manifest.json'
+    if not os.path.exists(manifest_name):
+        print(f'No manifest in {report_folder}, detecting question types from the raw data.')
+        write_manifest(detect_manifest(f'../csv_exports/{report_folder}/raw-data.csv'), report_folder)
+
+    with open(manifest_name) as f:
+        manifest = json.load(f)
+
+    for entry in manifest['questions']:
+        if entry['type'] not in QUESTION_TYPES:
+            print(f'Question {entry["number"]} has an unknown type "{entry["type"]}". Please use one of: '
+                  f'{", ".join(QUESTION_TYPES)}.')
+            sys.exit(1)
+
+    return manifest
+
+
+def get_field_date(manifest):
+    field_date = manifest.get('field_date')
+    if field_date is not None:
+        field_date = datetime.date.fromisoformat(field_date)
+    return field_date
+
+
+def get_question(df, entry):
+    """
+    Return the question of a manifest entry as it's written in the sheet's headers, "Q<number>: <text>", or just the
+    text for sheets whose headers don't have question numbers.
+    """
+    question = f'Q{entry["number"]}: {entry["text"]}'
+    if get_question_column(df, question) is None:
+        return entry['text']
+    return question
+
+
+def get_sections(entry):
+    """
+    Return the titles of the sections a manifest entry asks for, or None for every section.
+    """
+    sections = entry.get('sections')
+    if sections is not None:
+        sections = [f'{section} Data' for section in sections]
+    return sections
+
+
+def check_manifest_sections(manifest, import_data_name):
+    # Stop before exporting anything if a question asks for generations the sheet can't give without a field date
+    header = get_csv_header(import_data_name)
+    for entry in manifest['questions']:
+        check_generation_sections(header, get_field_date(manifest), get_sections(entry))
+
+
+def get_export_name(entry, report_folder, write_csv=True):
+    # Question <number>.csv in the report folder, or None to keep the question's sections in memory only
+    return f'../csv_exports/{report_folder}/Question {entry["number"]}.csv' if write_csv else None
+
+
+def export_question(df, entry, report_folder, dimensions, write_csv=True):
+    """
+    Export one question of the manifest to Question <number>.csv in the report folder with its type's module, and
+    return its sections.
+    """
+    module = QUESTION_TYPES[entry['type']]
+    return module.export_data_to_csv(df, get_question(df, entry), get_export_name(entry, report_folder, write_csv),
+                                     dimensions, get_sections(entry))
+
+
+def start_worker(import_data_name, questions, field_date):
+    """
+    Load the raw data and dimension table once in a worker process, from the Feather cache and dimension table file
+    the parent process has already written, so they aren't pickled and sent along with every question.
+    """
+    WORKER_DATA['data_frame'] = get_df_from_csv(import_data_name, questions=questions)
+    WORKER_DATA['dimensions'] = get_dimension_table(WORKER_DATA['data_frame'], import_data_name, field_date,
+                                                    report=False)
+
+
+def export_question_in_worker(entry, report_folder, write_csv=True):
+    """
+    Export a question with the worker's data and return how long it took in seconds, along with its sections.
+    """
+    start = time.perf_counter()
+    sections = export_question(WORKER_DATA['data_frame'], entry, report_folder, WORKER_DATA['dimensions'], write_csv)
+    return time.perf_counter() - start, sections
+
+
+def print_timings(manifest, timings, total_time):
+    """
+    Print how long each question took, in manifest order, followed by the total and the slowest question.
+    """
+    for entry, seconds in zip(manifest['questions'], timings):
+        print(f'Question {entry["number"]} ({entry["type"]}): {seconds:.2f}s')
+    if timings:
+        print(f'Exported {len(timings)} questions in {total_time:.2f}s, slowest question {max(timings):.2f}s')
+
+
+def sync_report_to_gsheet(report_tabs, gsheetkey):
+    """
+    Hand the sections of every tab of a report, a dict of tab name to the sections an exporter returned, straight to
+    the designated Google Sheet, laid out as they are in the CSVs. Only what changed since the last sync is sent.
+    """
+    sync_to_gsheet({sheet_name: get_sections_values(sections) for sheet_name, sections in report_tabs.items()},
+                   gsheetkey)
+
+
+def export_report(report_folder, manifest=None, processes=None, gsheetkey=None, write_csv=True):
+    """
+    Export every question in the report folder's manifest, plus demographics.csv unless the manifest turns it off. The
+    raw data is loaded once, with only the columns the manifest needs, and the dimension table is computed once and
+    shared by every question.
+
+    Questions are spread over processes worker processes, one per core by default. Each worker loads the data once
+    from the caches, and with processes=1 every question is exported in this process.
+
+    With a gsheetkey, every question and demographics are also synced to that Google Sheet, one tab each, straight
+    from memory. The CSVs are then only written if write_csv is set.
+    """
+    start = time.perf_counter()
+    if manifest is None:
+        manifest = get_manifest(report_folder)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    field_date = get_field_date(manifest)
+
+    import_data_name = f'../csv_exports/{report_folder}/raw-data.csv'
+    check_manifest_sections(manifest, import_data_name)
+    questions = [f'Q{entry["number"]}: {entry["text"]}' for entry in manifest['questions']]
+    data_frame = get_df_from_csv(import_data_name, questions=questions)
+    dimensions = get_dimension_table(data_frame, import_data_name, field_date)
+
+    if processes > 1:
+        with ProcessPoolExecutor(processes, initializer=start_worker,
+                                 initargs=(import_data_name, questions, field_date)) as executor:
+            # Results come back in manifest order, whichever question finishes first
+            results = list(executor.map(export_question_in_worker, manifest['questions'],
+                                        [report_folder] * len(manifest['questions']),
+                                        [write_csv] * len(manifest['questions'])))
+    else:
+        results = []
+        for entry in manifest['questions']:
+            question_start = time.perf_counter()
+            sections = export_question(data_frame, entry, report_folder, dimensions, write_csv)
+            results.append((time.perf_counter() - question_start, sections))
+
+    report_tabs = {f'Question {entry["number"]}': sections
+                   for entry, (seconds, sections) in zip(manifest['questions'], results)}
+    if manifest.get('demographics', True):
+        report_tabs['Demographics'] = demographics.export_data_to_csv(data_frame, report_folder if write_csv else None,
+                                                                      dimensions)
+    if gsheetkey is not None:
+        sync_report_to_gsheet(report_tabs, gsheetkey)
+
+    print_timings(manifest, [seconds for seconds, sections in results], time.perf_counter() - start)
+
+
+def get_accumulators(manifest, import_data_name):
+    """
+    Register the counts of every question in the manifest by its number, and of demographics unless the manifest leaves
+    them out, with the sheet's headers standing in for the sheet.
+    """
+    header = pd.DataFrame(columns=get_csv_header(import_data_name))
+    accumulators = {entry['number']: (QUESTION_TYPES[entry['type']].get_counts, get_question(header, entry))
+                    for entry in manifest['questions']}
+    if manifest.get('demographics', True):
+        accumulators['demographics'] = (demographics.get_counts, None)
+    return accumulators
+
+
+def export_counts(report_folder, manifest, totals, gsheetkey=None, write_csv=True):
+    """
+    Write every question and demographics from counts merged over the whole sheet, and sync them to the Google Sheet if
+    there's a gsheetkey.
+    """
+    report_tabs = {}
+    for entry in manifest['questions']:
+        report_tabs[f'Question {entry["number"]}'] = QUESTION_TYPES[entry['type']].export_counts_to_csv(
+            totals[entry['number']], get_export_name(entry, report_folder, write_csv), get_sections(entry))
+    if manifest.get('demographics', True):
+        report_tabs['Demographics'] = demographics.export_counts_to_csv(totals['demographics'],
+                                                                        report_folder if write_csv else None)
+    if gsheetkey is not None:
+        sync_report_to_gsheet(report_tabs, gsheetkey)
+
+
+def export_report_in_chunks(report_folder, manifest=None, chunksize=CHUNK_ROWS, gsheetkey=None, write_csv=True,
+                            incremental=False):
+    """
+    Export the same files as export_report from a raw data CSV too big to load in one piece. The sheet is read once,
+    chunksize rows at a time, and each chunk's dimension table is shared by the counts of every question and of
+    demographics, which are merged as the chunks go by and written once the whole sheet has been read. As with
+    export_report, a gsheetkey syncs the report to that Google Sheet from memory.
+
+    With incremental set, the merged counts are kept next to the raw data, and a rerun on a longer export of the same
+    survey only counts the respondents added since, as update_all_counts does.
+    """
+    start = time.perf_counter()
+    if manifest is None:
+        manifest = get_manifest(report_folder)
+    field_date = get_field_date(manifest)
+    import_data_name = f'../csv_exports/{report_folder}/raw-data.csv'
+    check_manifest_sections(manifest, import_data_name)
+    accumulators = get_accumulators(manifest, import_data_name)
+
+    if incremental:
+        totals = update_all_counts(import_data_name, accumulators, chunksize, field_date)
+    else:
+        totals = stream_all_counts(import_data_name, accumulators, chunksize, field_date)
+    export_counts(report_folder, manifest, totals, gsheetkey, write_csv)
+
+    print(f'Exported {len(manifest["questions"])} questions in one pass in {time.perf_counter() - start:.2f}s')
+
+
+def map_report_shard(report_folder, shard, partial_filename, manifest=None, chunksize=CHUNK_ROWS, schema=None):
+    """
+    The map step of a sharded report: count every question of the report over one shard from split_csv_into_shards,
+    and write the partial counts to partial_filename for reduce_report. The report folder only needs its manifest, or
+    the raw data's header to detect one from, so shards can be counted on other machines.
+    """
+    start = time.perf_counter()
+    if manifest is None:
+        manifest = get_manifest(report_folder)
+    accumulators = get_accumulators(manifest, shard['filename'])
+    partial = count_shard(shard['filename'], accumulators, shard['first_row'], chunksize, get_field_date(manifest),
+                          schema=schema)
+    save_partial_counts(partial, partial_filename)
+
+    print(f'Counted rows {shard["first_row"]} to {partial["rows"][0][1]} in {time.perf_counter() - start:.2f}s')
+    return partial_filename
+
+
+def reduce_report(report_folder, partial_filenames, manifest=None, gsheetkey=None, write_csv=True):
+    """
+    The reduce step of a sharded report: merge the partial counts from map_report_shard, or from earlier merges, and
+    write the same files as export_report.
+    """
+    if manifest is None:
+        manifest = get_manifest(report_folder)
+    partial = merge_partial_counts(load_partial_counts(filename) for filename in partial_filenames)
+    report_unmapped_regions(partial['totals'].get(UNMAPPED_REGIONS, {}))
+    export_counts(report_folder, manifest, partial['totals'], gsheetkey, write_csv)
+    return partial
+
+
+def export_report_in_shards(report_folder, shard_rows, manifest=None, processes=None, chunksize=CHUNK_ROWS,
+                            gsheetkey=None, write_csv=True):
+    """
+    Export the same files as export_report by splitting the raw data into shards of shard_rows rows, counting the
+    shards in worker processes and merging their partial counts. The shards and partial counts are kept in the report's
+    shards folder, so the map step can as well be run on other machines with map_report_shard and the partial counts
+    brought back for reduce_report.
+    """
+    start = time.perf_counter()
+    if manifest is None:
+        manifest = get_manifest(report_folder)
+    import_data_name = f'../csv_exports/{report_folder}/raw-data.csv'
+    check_manifest_sections(manifest, import_data_name)
+    warn_missing_field_date(get_csv_header(import_data_name), get_field_date(manifest))
+    shard_folder = f'../csv_exports/{report_folder}/shards'
+    shards = split_csv_into_shards(import_data_name, shard_rows, shard_folder)
+    schema = get_shard_schema(shard_folder)
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(map_report_shard, report_folder, shard,
+                                   f'{shard_folder}/counts-{shard["first_row"]}.json', manifest, chunksize, schema)
+                   for shard in shards]
+        partial_filenames = [future.result() for future in futures]
+    reduce_report(report_folder, partial_filenames, manifest, gsheetkey, write_csv)
+
+    print(f'Exported {len(manifest["questions"])} questions from {len(shards)} shards in '
+          f'{time.perf_counter() - start:.2f}s')
+
+
+if __name__ == "__main__":
+    # Set variables for analysis
+    report_folder = 'rg-2025-q2'
+    processes = None  # Worker processes to export questions with, one per core if None
+    chunksize = None  # Rows to read at a time for sheets too big to load in one piece, or None to load it whole
+    gsheetkey = None  # Google Sheet to sync the report to straight from memory, or None for the CSVs only
+    write_csv = True  # Also write the CSVs when syncing to a Google Sheet
+    incremental = False  # Only count respondents added since the last run, reading chunksize rows at a time
+    shard_rows = None  # Rows per shard to count in worker processes and merge, or None to count in one process
+
+    if shard_rows is not None:
+        export_report_in_shards(report_folder, shard_rows, processes=processes, chunksize=chunksize or CHUNK_ROWS,
+                                gsheetkey=gsheetkey, write_csv=write_csv)
+    elif chunksize is None and not incremental:
+        export_report(report_folder, processes=processes, gsheetkey=gsheetkey, write_csv=write_csv)
+    else:
+        export_report_in_chunks(report_folder, chunksize=chunksize or CHUNK_ROWS, gsheetkey=gsheetkey,
+                                write_csv=write_csv, incremental=incremental)
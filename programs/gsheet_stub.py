@@ -0,0 +1,333 @@
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+import gspread
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from csv_to_gsheet import (read_csv_values, sync_to_gsheet, upload_to_gsheets, write_csv_to_gsheet,
+                           write_csvs_to_gsheet, write_values_to_gsheet)
+from gsheet_to_csv import download_sheet_csv
+
+
+def make_api_error(status=429, message='Quota exceeded for quota metric \'Write requests\''):
+    """
+    Build the gspread.exceptions.APIError the API raises for an error response with the given status.
+    """
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps({'error': {'code': status, 'message': message}}).encode()
+    return gspread.exceptions.APIError(response)
+
+
+def parse_range(cell_range):
+    """
+    Split an A1 range such as 'Question 3'!B5 into its tab name and first cell, A1 for a whole tab.
+    """
+    tab, _, cell = cell_range.rpartition('!') if "'!" in cell_range else (cell_range, '', 'A1')
+    return tab[1:-1].replace("''", "'"), cell.split(':')[0]
+
+
+def trim_values(values):
+    """
+    Return rows of values as the API reads them back, without trailing blank cells or rows.
+    """
+    values = [list(cells) for cells in values]
+    for cells in values:
+        while cells and cells[-1] == '':
+            cells.pop()
+    while values and not values[-1]:
+        values.pop()
+    return values
+
+
+class StubClient:
+    """
+    A stand-in for an authorized gspread client that keeps spreadsheets in memory, so exports can be tested and
+    benchmarked offline. Every API request is recorded in requests and waits latency seconds, as a round-trip would.
+    A share error_rate of requests fail with a 429 quota error instead, before changing anything.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.errors = 0
+        self.spreadsheets = {}
+
+    def request(self, method):
+        with self.lock:
+            self.requests.append(method)
+            failed = self.random.random() < self.error_rate
+            self.errors += failed
+        time.sleep(self.latency)
+        if failed:
+            raise make_api_error()
+
+    def open_by_key(self, key):
+        self.request('open_by_key')
+        with self.lock:
+            return self.spreadsheets.setdefault(key, StubSpreadsheet(self, key))
+
+
+class StubSpreadsheet:
+    """
+    The parts of gspread.Spreadsheet the exports use, with each tab stored as a dict of its grid size and rows.
+    """
+
+    def __init__(self, client, key):
+        self.client = client
+        self.id = key
+        self.tabs = {}
+
+    def add_tab(self, title, rows, cols):
+        self.tabs[title] = {'sheetId': len(self.tabs), 'rowCount': int(rows), 'columnCount': int(cols), 'values': []}
+        return StubWorksheet(self, title)
+
+    def write_values(self, title, values, row=0, col=0):
+        # Write a block of values with its top left cell at (row, col), growing the tab past its edge as the values
+        # API does
+        tab = self.tabs[title]
+        for offset, new_row in enumerate(values):
+            while len(tab['values']) <= row + offset:
+                tab['values'].append([])
+            cells = tab['values'][row + offset]
+            cells.extend([''] * (col + len(new_row) - len(cells)))
+            cells[col:col + len(new_row)] = [str(value) for value in new_row]
+        tab['rowCount'] = max(tab['rowCount'], len(tab['values']))
+        tab['columnCount'] = max(tab['columnCount'], max((len(cells) for cells in tab['values']), default=0))
+
+    def read_values(self, title):
+        return trim_values(self.tabs[title]['values'])
+
+    def fetch_sheet_metadata(self, params=None):
+        self.client.request('fetch_sheet_metadata')
+        return {'sheets': [{'properties': {'sheetId': tab['sheetId'], 'title': title,
+                                           'gridProperties': {'rowCount': tab['rowCount'],
+                                                              'columnCount': tab['columnCount']}}}
+                           for title, tab in self.tabs.items()]}
+
+    def batch_update(self, body):
+        self.client.request('batch_update')
+        titles = {tab['sheetId']: title for title, tab in self.tabs.items()}
+        for request in body['requests']:
+            if 'addSheet' in request:
+                properties = request['addSheet']['properties']
+                if properties['title'] in self.tabs:
+                    raise ValueError(f'A sheet with the name "{properties["title"]}" already exists.')
+                grid = properties['gridProperties']
+                self.add_tab(properties['title'], grid['rowCount'], grid['columnCount'])
+            elif 'updateSheetProperties' in request:
+                properties = request['updateSheetProperties']['properties']
+                self.tabs[titles[properties['sheetId']]].update(properties['gridProperties'])
+        return {}
+
+    def values_batch_update(self, body=None):
+        self.client.request('values_batch_update')
+        for data in body['data']:
+            title, cell = parse_range(data['range'])
+            row, col = gspread.utils.a1_to_rowcol(cell)
+            self.write_values(title, data['values'], row - 1, col - 1)
+        return {}
+
+    def values_batch_get(self, ranges, params=None):
+        self.client.request('values_batch_get')
+        return {'valueRanges': [{'range': cell_range, 'values': self.read_values(parse_range(cell_range)[0])}
+                                for cell_range in ranges]}
+
+    def worksheet(self, title):
+        self.client.request('worksheet')
+        if title not in self.tabs:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        return StubWorksheet(self, title)
+
+    def add_worksheet(self, title, rows, cols):
+        self.client.request('add_worksheet')
+        return self.add_tab(title, rows, cols)
+
+
+class StubWorksheet:
+    """
+    The parts of gspread.Worksheet write_csv_to_gsheet uses.
+    """
+
+    def __init__(self, spreadsheet, title):
+        self.spreadsheet = spreadsheet
+        self.title = title
+
+    def update(self, range_name, values, value_input_option=None):
+        self.spreadsheet.client.request('update')
+        self.spreadsheet.write_values(self.title, values)
+
+
+class StubSheetHandler(BaseHTTPRequestHandler):
+    """
+    Answers the Google Sheets CSV export URLs from the server's sheets, a dict of (key, sheet) to CSV text, with an
+    ETag of the content and a 304 when the request's If-None-Match still matches.
+    """
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        key = url.path.split('/')[3]
+        sheet = int(query['gid'][0]) if 'gid' in query else query['sheet'][0]
+        self.server.requests.append((key, sheet))
+
+        text = self.server.sheets.get((key, sheet))
+        if text is None:
+            self.send_error(404)
+            return
+        # Hash each version of a sheet once, as the real server keeps its ETag
+        if self.server.etags.get((key, sheet), (None,))[0] is not text:
+            content = text.encode()
+            etag = '"' + hashlib.blake2b(content, digest_size=8).hexdigest() + '"'
+            self.server.etags[(key, sheet)] = (text, content, etag)
+        text, content, etag = self.server.etags[(key, sheet)]
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_gsheet_csvs(sheets):
+    """
+    Start a local HTTP stand-in for the Google Sheets CSV export on a free port, serving a dict of (key, sheet) to CSV
+    text, which can be changed while it runs. Returns the server, whose base_url goes in place of GSHEET_URL and whose
+    requests lists every (key, sheet) asked for. Call shutdown() on it when done.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubSheetHandler)
+    server.sheets = sheets
+    server.requests = []
+    server.etags = {}
+    server.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def benchmark_gsheet_download(content, cache_folder, repeats=3):
+    """
+    Download a sheet of CSV text from a local stand-in for Google Sheets, then again unchanged and once it has changed,
+    checking each download matches and printing how long each took.
+    """
+    server = serve_gsheet_csvs({('benchmark', 0): content})
+    try:
+        for name in ['first download'] + ['unchanged'] * repeats + ['changed']:
+            if name == 'changed':
+                content = content + content.split('\n', 1)[1]
+                server.sheets[('benchmark', 0)] = content
+            start = time.perf_counter()
+            filename = download_sheet_csv('benchmark', 0, cache_folder, server.base_url)
+            seconds = time.perf_counter() - start
+            with open(filename, newline='') as f:
+                assert f.read() == content
+            print(f'{name}: {seconds:.3f}s')
+    finally:
+        server.shutdown()
+
+
+def benchmark_gsheet_export(files, latency=0.2):
+    """
+    Export the same files tab by tab and in one batch to stub spreadsheets with latency seconds per request, check both
+    give the same tabs, and print the requests and time each took.
+    """
+    results = {}
+    for name in ['tab by tab', 'batched']:
+        client = StubClient(latency)
+        start = time.perf_counter()
+        if name == 'tab by tab':
+            for sheet_name, filename in files.items():
+                write_csv_to_gsheet(filename, 'benchmark', sheet_name, client)
+        else:
+            write_csvs_to_gsheet(files, 'benchmark', client)
+        results[name] = (len(client.requests), time.perf_counter() - start,
+                         {title: tab['values'] for title, tab in client.spreadsheets['benchmark'].tabs.items()})
+
+    assert results['tab by tab'][2] == results['batched'][2]
+    for name, (request_count, seconds, tabs) in results.items():
+        print(f'{name}: {len(files)} tabs in {request_count} requests, {seconds:.2f}s')
+
+
+def benchmark_upload_scheduler(uploads, latency=0.2, error_rate=0.2, requests_per_minute=600, workers=4,
+                               attempts=3):
+    """
+    Upload to stub spreadsheets that fail a share error_rate of requests with quota errors, trying failed tabs again
+    up to attempts times, then check every tab was written and print the requests, errors and time it took.
+    """
+    client = StubClient(latency, error_rate)
+    start = time.perf_counter()
+    remaining = uploads
+    for attempt in range(attempts):
+        remaining = upload_to_gsheets(remaining, client, requests_per_minute, workers, backoff=latency)
+        if not remaining:
+            break
+
+    for gsheetkey, tabs in uploads.items():
+        written = {title: tab['values'] for title, tab in client.spreadsheets[gsheetkey].tabs.items()}
+        assert all(written.get(sheet_name) == values for sheet_name, values in tabs.items()
+                   if sheet_name not in remaining.get(gsheetkey, {}))
+
+    print(f'{workers} workers: {len(client.requests)} requests with {client.errors} quota errors in '
+          f'{time.perf_counter() - start:.2f}s, {sum(len(tabs) for tabs in remaining.values())} tabs still failed')
+
+
+def benchmark_gsheet_sync(tabs, state_filename, latency=0.2):
+    """
+    Push tabs to a stub spreadsheet in full, then sync them with a few cells changed, a tab shortened and nothing
+    changed, checking the sheet matches the local values each time and printing the requests each sync took.
+    """
+    client = StubClient(latency)
+    write_values_to_gsheet(tabs, 'benchmark', client)
+    if os.path.exists(state_filename):
+        os.remove(state_filename)
+
+    first, second = list(tabs)[:2]
+    changes = {'first sync, read back': tabs,
+               'a few cells changed': {**tabs, first: [row[:-1] + ['changed'] if number % 10 == 1 else row
+                                                       for number, row in enumerate(tabs[first])]},
+               'a tab shortened': {**tabs, second: tabs[second][:len(tabs[second]) // 2]},
+               'nothing changed': {**tabs, second: tabs[second][:len(tabs[second]) // 2]}}
+
+    for name, values in changes.items():
+        requests_before = len(client.requests)
+        start = time.perf_counter()
+        sync_to_gsheet(values, 'benchmark', client, state_filename)
+        spreadsheet = client.spreadsheets['benchmark']
+        assert all(spreadsheet.read_values(sheet_name) == trim_values(tab_values)
+                   for sheet_name, tab_values in values.items())
+        print(f'{name}: {len(client.requests) - requests_before} requests, {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == "__main__":
+    # Set variables for the benchmark
+    report_folder = 'rg-2025-q2'
+    latency = 0.2  # Seconds per request, about a Sheets API round-trip
+    error_rate = 0.2  # Share of requests that fail with a quota error in the scheduler benchmark
+
+    files = {f'Question {num}': f'../csv_exports/{report_folder}/Question {num}.csv' for num in range(3, 17)}
+    benchmark_gsheet_export(files, latency)
+
+    tabs = {sheet_name: read_csv_values(filename) for sheet_name, filename in files.items()}
+    uploads = {f'spreadsheet {number}': tabs for number in range(4)}
+    for workers in [1, 4]:
+        benchmark_upload_scheduler(uploads, latency, error_rate, workers=workers)
+
+    benchmark_gsheet_sync(tabs, f'../csv_exports/{report_folder}/gsheet-state-benchmark.json', latency)
+
+    with open(f'../csv_exports/{report_folder}/raw-data.csv', newline='') as f:
+        benchmark_gsheet_download(f.read(), f'../csv_exports/{report_folder}/gsheet-cache-benchmark')
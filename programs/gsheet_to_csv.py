@@ -1,14 +1,73 @@
-import pandas as pd
 import datetime
+import json
+import os
+import shutil
+import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+from cross_question_functions import get_df_from_csv
 
+GSHEET_URL = 'https://docs.google.com'
+GSHEET_CACHE_FOLDER = '../csv_exports/gsheet-cache'  # Downloaded sheets, kept to skip downloads when nothing changed
+DOWNLOAD_BLOCK_SIZE = 1 << 20
 
-def get_df_from_gsheet(key, sheet):
+
+def get_sheet_csv_url(key, sheet, base_url=GSHEET_URL):
+    """
+    Return the URL that exports one sheet of a Google Sheet as CSV. An int sheet is the tab's gid, from #gid= in its
+    URL, and exports the tab exactly as it's shown. A sheet name goes through the visualization API, which can blank
+    cells that don't match the type of the rest of their column.
+    """
+    if isinstance(sheet, int):
+        return f'{base_url}/spreadsheets/d/{key}/export?format=csv&gid={sheet}'
+    return f'{base_url}/spreadsheets/d/{key}/gviz/tq?tqx=out:csv&sheet={urllib.parse.quote(sheet)}'
+
+
+def download_sheet_csv(key, sheet, cache_folder=GSHEET_CACHE_FOLDER, base_url=GSHEET_URL):
     """
-    Takes a Google Sheet key and a sheet name and returns the data in that sheet as a Pandas dataframe.
+    Download one sheet of a Google Sheet as CSV into the cache folder and return the file's path. The ETag and
+    Last-Modified of the download are saved with it, so the next download is a conditional request and the cached
+    file is used as it is when the server says nothing changed. The response is streamed to disk in blocks, so big
+    sheets never have to fit in memory.
     """
-    url = f'https://docs.google.com/spreadsheet/ccc?key={key}&output=xlsx'
-    df = pd.read_excel(url, sheet_name=sheet)
-    return df
+    os.makedirs(cache_folder, exist_ok=True)
+    cache_name = f'{cache_folder}/{key}-{urllib.parse.quote(str(sheet), safe="")}'
+    filename = f'{cache_name}.csv'
+    headers = {}
+    if os.path.exists(filename) and os.path.exists(f'{cache_name}.json'):
+        with open(f'{cache_name}.json') as f:
+            validators = json.load(f)
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+    request = urllib.request.Request(get_sheet_csv_url(key, sheet, base_url), headers=headers)
+    try:
+        with urllib.request.urlopen(request) as response:
+            # Write to a temporary file first, so a failed download never replaces a good cached copy
+            with open(f'{filename}.part', 'wb') as f:
+                shutil.copyfileobj(response, f, DOWNLOAD_BLOCK_SIZE)
+            validators = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+    except urllib.error.HTTPError as error:
+        if error.code != 304:
+            raise
+        print(f'Sheet {sheet} is unchanged, using the cached copy')
+        return filename
+
+    os.replace(f'{filename}.part', filename)
+    with open(f'{cache_name}.json', 'w') as f:
+        json.dump(validators, f)
+    return filename
+
+
+def get_df_from_gsheet(key, sheet, cache_folder=GSHEET_CACHE_FOLDER, base_url=GSHEET_URL, engine='c'):
+    """
+    Takes a Google Sheet key and a sheet name or gid and returns the data in that sheet as a Pandas dataframe, loaded
+    from the downloaded CSV by get_df_from_csv, so it's typed and cached the same way as a raw data CSV.
+    """
+    return get_df_from_csv(download_sheet_csv(key, sheet, cache_folder, base_url), engine=engine)
 
 
 def write_gsheet_to_csv(df, filename=None):
@@ -24,12 +83,28 @@ def write_gsheet_to_csv(df, filename=None):
     print(f"Data successfully written to {filename}")
 
 
+def download_gsheet_to_csv(key, sheet, filename, cache_folder=GSHEET_CACHE_FOLDER, base_url=GSHEET_URL):
+    """
+    Copy one sheet of a Google Sheet straight to a CSV file, without parsing it, skipping the copy when the file is
+    already the latest download. The sheet must be a gid, since raw data downloaded by name can lose answers.
+    """
+    if not isinstance(sheet, int):
+        print(f'{sheet} is a sheet name. Use the gid from #gid= in the tab\'s URL, so no answers are blanked.')
+        sys.exit(1)
+    downloaded = download_sheet_csv(key, sheet, cache_folder, base_url)
+    if os.path.exists(filename) and os.path.getmtime(filename) >= os.path.getmtime(downloaded):
+        print(f"{filename} is up to date")
+        return
+
+    shutil.copyfile(downloaded, filename)
+    print(f"Data successfully written to {filename}")
+
+
 if __name__ == "__main__":
     # https://docs.google.com/spreadsheets/d/1p3z3WnzGesafG7se-6eJn5vfGaiErQiq_VHOz0Iu8hU/
 
     gsheetkey = '1p3z3WnzGesafG7se-6eJn5vfGaiErQiq_VHOz0Iu8hU'
-    sheet_name = 'Raw Data'
+    sheet_gid = 0  # Raw data tab's gid, from #gid= in its URL, so it's exported exactly as shown
     filename = '../csv_exports/rg-2025-q2/raw-data.csv'
 
-    raw_data = get_df_from_gsheet(gsheetkey, sheet_name)
-    write_gsheet_to_csv(raw_data, filename)
+    download_gsheet_to_csv(gsheetkey, sheet_gid, filename)
@@ -1,387 +1,222 @@
 import pandas as pd
-import datetime
-import sys
+import numpy as np
 from cross_question_functions import *
 
+# Label and title of each section, in the order they're written
+SECTIONS = {'All respondents': 'Overall Data', 'Gender': 'Gender Data', 'Age': 'Age Data',
+            'Generation': 'Generation Data', 'Education': 'Education Data', 'Region': 'Region Data'}
 
-def get_matrix_statements(df, question):
-    if question not in df.columns:
-        return None
 
-    statements = set()
-
-    # Iterate through first row in the specified column
-    for entry in df[question].dropna().unique():
-        # Split the entry into individual key-value pairs
-        items = entry.split(" | ")
-        for item in items:
-            if ':' in item:
-                key, value = item.split(":", 1)
-                statements.add(key.strip())
-
-    return list(statements)
-
-
-def get_matrix_responses(df, question):
-    if question not in df.columns:
-        print('Question not available. Please check that the provided question is valid for this sheet.')
-        sys.exit(1)
-
-    responses = set()
-
-    # Iterate through each row in the specified column
-    for entry in df[question].dropna().unique():
-        # Split the entry into individual key-value pairs
-        items = entry.split(" | ")
-        for item in items:
-            if ':' in item:
-                key, value = item.split(":", 1)
-                responses.add(value.strip())
-
-    return list(responses)
-
-
-def get_single_matrix_response(df, question, respondent, statement):
-    if question in df.columns:
-        try:
-            items = df.loc[respondent, question].split(" | ")
-        # Respondent didn't respond to this question
-        except AttributeError:
-            return None
-        for item in items:
-            if ':' in item:
-                key, value = item.split(":", 1)
-                stripped_key = key.strip(' ')
-                stripped_value = value.strip(' ')
-                if stripped_key == statement:
-                    return stripped_value
-    else:
+def get_matrix_statements(df, question, matrix=None):
+    if get_question_column(df, question) is None:
         return None
+    if matrix is None:
+        matrix = get_matrix_long_table(df, question)
+
+    return list(matrix['Statement'].cat.categories)
+
+
+def get_matrix_responses(df, question, matrix=None):
+    if matrix is None:
+        matrix = get_matrix_long_table(df, question)
+
+    return list(matrix['Response'].cat.categories)
+
+
+def get_matrix_counts(matrix, groups):
+    """
+    Count every (group, statement, response) combination in one pass over the long table and return the groups with a
+    groups x statements x responses array of counts, and the number of respondents in each group who answered at least
+    one statement.
+    """
+    statement_total = len(matrix['Statement'].cat.categories)
+    response_total = len(matrix['Response'].cat.categories)
+
+    group_codes, group_list = get_dimension_codes(groups)
+    respondents = matrix['Respondent'].to_numpy()
+    pair_codes = (matrix['Statement'].cat.codes.to_numpy(dtype=np.int64) * response_total
+                  + matrix['Response'].cat.codes.to_numpy(dtype=np.int64))
+    counts = count_by_group(group_codes[respondents], pair_codes, len(group_list), statement_total * response_total)
+
+    # Add to count only if respondent answered this question
+    answered_groups = group_codes[np.unique(respondents)]
+    group_counts = np.bincount(answered_groups[answered_groups >= 0], minlength=len(group_list))
+
+    return group_list, counts.reshape(len(group_list), statement_total, response_total), group_counts
+
+
+def calculate_percentages(group_list, counts, group_counts):
+    """
+    Divide the counts of each group by the number of respondents in it who answered, leaving out groups where nobody
+    did. Returns the groups that answered with their percentages.
+    """
+    answered = group_counts > 0
+    percentages = counts[answered] / group_counts[answered, np.newaxis, np.newaxis]
+    return group_list[answered], percentages
+
+
+def get_matrix_percentages(df, question, groups, matrix=None):
+    """
+    Return the groups that answered the question with a groups x statements x responses array of percentages. A
+    respondent is counted in their group's base if they answered at least one statement.
+    """
+    if matrix is None:
+        matrix = get_matrix_long_table(df, question)
 
+    return calculate_percentages(*get_matrix_counts(matrix, groups))
 
-def get_overall_data_as_matrix(df, question):
-    statements = get_matrix_statements(df, question)
-    response_options = get_matrix_responses(df, question)
-    response_checker = False
-    overall_count = 0
-    response_data = {statement: {response: 0 for response in response_options} for statement in statements}
 
-    for i, row in df.iterrows():
-        for statement in statements:
-            response = get_single_matrix_response(df, question, i, statement)
-            if response in response_options:
-                response_checker = True
-                response_data[statement][response] += 1
+def get_overall_data_as_matrix(df, question, matrix=None):
+    if matrix is None:
+        matrix = get_matrix_long_table(df, question)
+    statements = get_matrix_statements(df, question, matrix)
+    response_options = get_matrix_responses(df, question, matrix)
+    groups = get_overall_groups(df, 'All respondents')
+    group_list, percentages = get_matrix_percentages(df, question, groups, matrix)
 
-        # Add to count only if respondent answered this question
-        if response_checker:
-            overall_count += 1
-            response_checker = False
+    return get_overall_data_from_percentages(group_list, statements, response_options, percentages)
 
-    # Calculate percentages
-    percentage_data = {}
-    for statement, responses in response_data.items():
-        percentage_data[statement] = {response: (count / overall_count) for response, count in responses.items()}
+
+def get_overall_data_from_percentages(group_list, statements, response_options, percentages):
+    if not len(group_list):
+        return pd.DataFrame()
 
     # Convert to DataFrame and insert the statements as the first column
-    data = pd.DataFrame(percentage_data).T
-    data.insert(0, 'All respondents', data.index)
-
-    return pd.DataFrame(data)
-
-
-def get_gender_data(df, question):
-    statements = get_matrix_statements(df, question)
-    response_options = get_matrix_responses(df, question)
-    gender_counts = {gender: 0 for gender in get_gender_list(df)}
-    response_checker = False
-    genders = get_gender_list(df)
-    responses_by_gender = {gender:
-                               {statement:
-                                    {response: 0 for response in response_options}
-                                for statement in statements}
-                           for gender in genders}
-
-    for i, row in df.iterrows():
-        gender = get_gender(df, i)
-        for statement in statements:
-            response = get_single_matrix_response(df, question, i, statement)
-            if (gender in responses_by_gender
-                    and statement in responses_by_gender[gender]
-                    and response in responses_by_gender[gender][statement]
-            ):
-                responses_by_gender[gender][statement][response] += 1
-                response_checker = True
-        if response_checker == True:
-            gender_counts[gender] += 1
-            response_checker = False
-
-    # Initialize a list to hold data for all generations
-    all_data_frames = []
-
-    # Calculate percentages and prepare the DataFrame for each generation
-    for gender, statements in responses_by_gender.items():
-        percentage_data = {}
-        generation_count = gender_counts[gender]
-        for statement, responses in statements.items():
-            percentage_data[statement] = {}
-            for response, count in responses.items():
-                percentage_data[statement][response] = (count / generation_count)
-
-        # Create a DataFrame for the current gender
-        gender_df = pd.DataFrame(percentage_data).T
-        gender_df['Gender'] = gender  # Add the gender for each column
-        all_data_frames.append(gender_df)
-
-    # Concatenate all generation data frames into a single DataFrame
-    final_data = pd.concat(all_data_frames, axis=0)
-    final_data.reset_index(inplace=True, drop=False)
-    final_data.rename(columns={'index': 'Statement'}, inplace=True)
+    data = pd.DataFrame(percentages[0], index=statements, columns=response_options)
+    data.insert(0, group_list[0], data.index)
 
-    return final_data
+    return data
 
 
-def get_age_data(df, question):
-    statements = get_matrix_statements(df, question)
-    response_options = get_matrix_responses(df, question)
-    response_checker = False
-    ages = get_age_list(df)
-    age_counts = {age: 0 for age in ages}
-    responses_by_age = {age:
-                            {statement:
-                                 {response: 0 for response in response_options}
-                             for statement in statements}
-                        for age in ages}
-
-    for i, row in df.iterrows():
-        age = get_age(df, i)
-        for statement in statements:
-            response = get_single_matrix_response(df, question, i, statement)
-            if (age in responses_by_age
-                    and statement in responses_by_age[age]
-                    and response in responses_by_age[age][statement]
-            ):
-                responses_by_age[age][statement][response] += 1
-                response_checker = True
-        if response_checker:
-            age_counts[age] += 1
-            response_checker = False
-
-    # Initialize a list to hold data for all ages
-    all_data_frames = []
-
-    # Calculate percentages and prepare the DataFrame for each age
-    for age, statements in responses_by_age.items():
-        percentage_data = {}
-        age_count = age_counts[age]
-        for statement, responses in statements.items():
-            percentage_data[statement] = {}
-            for response, count in responses.items():
-                percentage_data[statement][response] = (count / age_count)
-
-        # Create a DataFrame for the current age
-        age_df = pd.DataFrame(percentage_data).T
-        age_df['Age'] = age  # Add the age for each column
-        all_data_frames.append(age_df)
-
-    # Concatenate all age data frames into a single DataFrame
-    final_data = pd.concat(all_data_frames, axis=0)
-    final_data.reset_index(inplace=True, drop=False)
-    final_data.rename(columns={'index': 'Statement'}, inplace=True)
+def get_section_data(df, question, label, groups, matrix=None):
+    """
+    Return a DataFrame with the percentage of each response to each statement within each group, one row per group and
+    statement.
+    """
+    if matrix is None:
+        matrix = get_matrix_long_table(df, question)
+    statements = get_matrix_statements(df, question, matrix)
+    response_options = get_matrix_responses(df, question, matrix)
+    group_list, percentages = get_matrix_percentages(df, question, groups, matrix)
 
-    return final_data
+    return get_section_data_from_percentages(label, group_list, statements, response_options, percentages)
 
 
-def get_generation_data(df, question):
-    statements = get_matrix_statements(df, question)
-    response_options = get_matrix_responses(df, question)
-    response_checker = False
-    generation_counts = {generation: 0 for generation in get_generations_list()}
-    generations = get_generations_list()
-    responses_by_generation = {generation:
-                                       {statement:
-                                            {response: 0 for response in response_options}
-                                        for statement in statements}
-                                   for generation in generations}
-
-    for i, row in df.iterrows():
-        generation = get_generation(df, i)
-        for statement in statements:
-            response = get_single_matrix_response(df, question, i, statement)
-            if (generation in responses_by_generation
-                    and statement in responses_by_generation[generation]
-                    and response in responses_by_generation[generation][statement]
-            ):
-                responses_by_generation[generation][statement][response] += 1
-                response_checker = True
-        if response_checker == True:
-            generation_counts[generation] += 1
-            response_checker = False
-
-    # Initialize a list to hold data for all generations
-    all_data_frames = []
-
-    # Calculate percentages and prepare the DataFrame for each generation
-    for generation, statements in responses_by_generation.items():
-        percentage_data = {}
-        generation_count = generation_counts[generation]
-        for statement, responses in statements.items():
-            percentage_data[statement] = {}
-            for response, count in responses.items():
-                percentage_data[statement][response] = (count / generation_count)
-
-        # Create a DataFrame for the current generation
-        gen_df = pd.DataFrame(percentage_data).T
-        gen_df['Generation'] = generation  # Add the generation for each column
-        all_data_frames.append(gen_df)
-
-    # Concatenate all generation data frames into a single DataFrame
-    final_data = pd.concat(all_data_frames, axis=0)
-    final_data.reset_index(inplace=True, drop=False)
-    final_data.rename(columns={'index': 'Statement'}, inplace=True)
+def get_section_data_from_percentages(label, group_list, statements, response_options, percentages):
+    final_data = pd.DataFrame(percentages.reshape(-1, len(response_options)), columns=response_options)
+    final_data.insert(0, 'Statement', np.tile(np.asarray(statements, dtype=object), len(group_list)))
+    final_data[label] = np.repeat(group_list, len(statements))  # Add the group for each column
 
     return final_data
 
 
-def get_education_data(df, question):
-    statements = get_matrix_statements(df, question)
-    response_options = get_matrix_responses(df, question)
-    education_counts = {education: 0 for education in get_education_list(df)}
-    response_checker = False
-    education_levels = get_education_list(df)
-    responses_by_education = {education:
-                               {statement:
-                                    {response: 0 for response in response_options}
-                                for statement in statements}
-                           for education in education_levels}
-
-    for i, row in df.iterrows():
-        education = get_education(df, i)
-        for statement in statements:
-            response = get_single_matrix_response(df, question, i, statement)
-            if (education in responses_by_education
-                    and statement in responses_by_education[education]
-                    and response in responses_by_education[education][statement]
-            ):
-                responses_by_education[education][statement][response] += 1
-                response_checker = True
-        if response_checker:
-            education_counts[education] += 1
-            response_checker = False
-
-    # Initialize a list to hold data for all education levels
-    all_data_frames = []
-
-    # Calculate percentages and prepare the DataFrame for each education level
-    for education, statements in responses_by_education.items():
-        percentage_data = {}
-        education_count = education_counts[education]
-        for statement, responses in statements.items():
-            percentage_data[statement] = {}
-            for response, count in responses.items():
-                percentage_data[statement][response] = (count / education_count)
-
-        # Create a DataFrame for the current education level
-        education_df = pd.DataFrame(percentage_data).T
-        education_df['Education'] = education  # Add the education for each column
-        all_data_frames.append(education_df)
-
-    # Concatenate all generation data frames into a single DataFrame
-    final_data = pd.concat(all_data_frames, axis=0)
-    final_data.reset_index(inplace=True, drop=False)
-    final_data.rename(columns={'index': 'Statement'}, inplace=True)
+def get_counts(df, question, dimensions=None, matrix=None):
+    """
+    Count the responses to each statement within the groups of every section as count tables, which merge_counts can
+    add up across chunks of the sheet. Statements and responses are keyed by the row and position of their first
+    answer.
+    """
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    if matrix is None:
+        matrix = get_matrix_long_table(df, question)
 
-    return final_data
+    axes = []
+    respondents = matrix['Respondent'].to_numpy() + get_start_row(df)
+    for name in ['Statement', 'Response']:
+        # Categories are in order of first appearance, so the first position of each code is its first answer
+        _, positions = np.unique(matrix[name].cat.codes.to_numpy(), return_index=True)
+        keys = [(int(respondents[position]), int(position)) for position in positions]
+        axes.append((matrix[name].cat.categories, keys))
 
+    counts = {}
+    for label, groups in get_section_groups(df, dimensions, SECTIONS).items():
+        group_list, section_counts, group_counts = get_matrix_counts(matrix, groups)
+        group_axis = get_group_axis(df, groups)
+        counts[label] = {'Counts': make_count_table([group_axis] + axes, section_counts),
+                         'Answered': make_count_table([group_axis], group_counts)}
 
+    return counts
 
-def get_region_data(df, question):
-    statements = get_matrix_statements(df, question)
-    response_options = get_matrix_responses(df, question)
-    region_counts = {region: 0 for region in get_region_list(df)}
-    response_checker = False
-    regions = get_region_list(df)
-    responses_by_region = {region:
-                                       {statement:
-                                            {response: 0 for response in response_options}
-                                        for statement in statements}
-                                   for region in regions}
-
-    for i, row in df.iterrows():
-        region = get_region(df, i)
-        for statement in statements:
-            response = get_single_matrix_response(df, question, i, statement)
-            if (region in responses_by_region
-                    and statement in responses_by_region[region]
-                    and response in responses_by_region[region][statement]
-            ):
-                responses_by_region[region][statement][response] += 1
-                response_checker = True
-        if response_checker == True:
-            region_counts[region] += 1
-            response_checker = False
-
-    # Initialize a list to hold data for all generations
-    all_data_frames = []
-
-    # Calculate percentages and prepare the DataFrame for each region
-    for region, statements in responses_by_region.items():
-        percentage_data = {}
-        region_count = region_counts[region]
-        for statement, responses in statements.items():
-            percentage_data[statement] = {}
-            for response, count in responses.items():
-                percentage_data[statement][response] = (count / region_count)
-
-        # Create a DataFrame for the current region
-        region_df = pd.DataFrame(percentage_data).T
-        region_df['Region'] = region  # Add the region for each column
-        all_data_frames.append(region_df)
-
-    # Concatenate all generation data frames into a single DataFrame
-    final_data = pd.concat(all_data_frames, axis=0)
-    final_data.reset_index(inplace=True, drop=False)
-    final_data.rename(columns={'index': 'Statement'}, inplace=True)
 
-    return final_data
+def get_gender_data(df, question, dimensions=None, matrix=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    return get_section_data(df, question, 'Gender', dimensions['Gender'], matrix)
+
 
+def get_age_data(df, question, dimensions=None, matrix=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    return get_section_data(df, question, 'Age', dimensions['Age'], matrix)
 
-def write_section_to_csv(data, section_name, filename, mode='w'):
-    if isinstance(data, pd.DataFrame) and not data.empty:
-        with open(filename, mode) as f:
-            if mode == 'a':  # Add a newline before the section name only in append mode to avoid leading newlines
-                f.write("\n")
-            f.write(f"{section_name}\n")  # Write section name to CSV
-            data.to_csv(f, index=False, header=True)  # Append data under section name
 
-    else:
-        print(f"No {section_name.lower()} to write.")
+def get_generation_data(df, question, dimensions=None, matrix=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    return get_section_data(df, question, 'Generation', dimensions['Generation'], matrix)
 
 
-def export_data_to_csv(df, question, filename):
+def get_education_data(df, question, dimensions=None, matrix=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    return get_section_data(df, question, 'Education', dimensions['Education'], matrix)
+
+
+def get_region_data(df, question, dimensions=None, matrix=None, level='Region'):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    return get_section_data(df, question, level, dimensions[level], matrix)
+
+
+def export_data_to_csv(df, question, filename, dimensions=None, sections=None):
     """
     Take the imported data, question, and export all required data to a new CSV with the corresponding filename,
-    appending each section of the data to the file.
+    appending each section of the data to the file. If sections is given, only the sections with those titles are
+    written. The sections are always returned as a dict of title to DataFrame, and only written if filename is set.
+    """
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    check_generation_sections(df.columns, dimensions.attrs.get('field_date'), sections)
+    matrix = get_matrix_long_table(df, question)
+    groups = get_section_groups(df, dimensions, SECTIONS)
+
+    def build_section(label):
+        if label == 'All respondents':  # The overall section is laid out with one row per statement
+            return get_overall_data_as_matrix(df, question, matrix)
+        return get_section_data(df, question, label, groups[label], matrix)
+
+    return export_sections(SECTIONS, build_section, filename, sections)
+
+
+def export_counts_to_csv(counts, filename, sections=None):
+    """
+    Write the sections of counts from get_counts, merged over the whole sheet, and return them the same way as
+    export_data_to_csv.
     """
+    def build_section(label):
+        (group_list, statements, response_options), section_counts = sort_count_table(counts[label]['Counts'])
+        _, group_counts = sort_count_table(counts[label]['Answered'])
+        group_list, percentages = calculate_percentages(group_list, section_counts, group_counts)
+        if label == 'All respondents':
+            return get_overall_data_from_percentages(group_list, statements, response_options, percentages)
+        return get_section_data_from_percentages(label, group_list, statements, response_options, percentages)
 
-    write_section_to_csv(get_overall_data_as_matrix(df, question), 'Overall Data', filename, 'w')
-    write_section_to_csv(get_gender_data(df, question), 'Gender Data', filename, 'a')
-    write_section_to_csv(get_age_data(df, question), 'Age Data', filename, 'a')
-    # write_section_to_csv(get_generation_data(df, question), 'Generation Data', filename, 'a')
-    write_section_to_csv(get_education_data(df, question), 'Education Data', filename, 'a')
-    write_section_to_csv(get_region_data(df, question), 'Region Data', filename, 'a')
+    return export_sections(SECTIONS, build_section, filename, sections)
 
 
 if __name__ == "__main__":
     # Set variables for analysis
     report_folder = 'rg-2025-q2'
+    field_date = None  # Date the survey was in field (datetime.date), needed for generations when there's only an age
     question_number = '16'
     question_text = 'When you define your own career success, how important are the following factors?'
 
     # Export data to CSV
     import_data_name = f'../csv_exports/{report_folder}/raw-data.csv'
-    data_frame = get_df_from_csv(import_data_name)
     my_question = f'Q{question_number}: {question_text}'
+    data_frame = get_df_from_csv(import_data_name, questions=[my_question])
+    dimensions = get_dimension_table(data_frame, import_data_name, field_date)
     export_data_name = f'../csv_exports/{report_folder}/Question {question_number}.csv'
-    export_data_to_csv(data_frame, my_question, export_data_name)
+    export_data_to_csv(data_frame, my_question, export_data_name, dimensions)
 
@@ -1,279 +1,225 @@
 import pandas as pd
-import datetime
+import numpy as np
 import sys
 from cross_question_functions import *
 
+try:
+    from scipy import sparse
+except ImportError:  # scipy is optional, without it the indicator matrix is always dense
+    sparse = None
 
-def get_multi_responses(df, question):
-    if question not in df.columns:
-        return None
+SPARSE_OPTION_COUNT = 50
+
+# Label and title of each section, in the order they're written
+SECTIONS = {'All respondents': 'Overall Data', 'Gender': 'Gender Data', 'Age': 'Age Data',
+            'Generation': 'Generation Data', 'Education': 'Education Data', 'Region': 'Region Data'}
 
-    question_responses = set()
 
+def get_answers(df, question):
+    """
+    Return the option columns of a multiple-response question along with the answers given in each of them.
+    """
     # Identify columns containing responses for the question
-    question_columns = [col for col in df.columns if question in col]
+    question_columns = get_question_columns(df, question)
+    if not question_columns:
+        print('Question not available. Please check that the provided question is valid for this sheet.')
+        sys.exit(1)
 
-    if question_columns:
-        # Loop through each column with responses for Q6
-        for col in question_columns:
-            # Drop empty cells and get unique responses in this column
-            unique_responses = df[col].dropna().str.strip().unique()
+    answers = [df[col].dropna().astype(str).str.strip() for col in question_columns]
+    return question_columns, answers
 
-            # Add each unique response to the list if it's not already present
-            for response in unique_responses:
-                if response not in question_responses:
-                    question_responses.add(response)
 
-    return question_responses
+def get_indicator_matrix(df, question):
+    """
+    Convert the option columns of a multiple-response question into a respondents x options indicator matrix, with
+    a final column marking the respondents who chose at least one option. The matrix is sparse when the question has
+    more than SPARSE_OPTION_COUNT options and scipy is installed. Returns the response options along with the matrix.
+    """
+    question_columns, answers = get_answers(df, question)
+    response_options = pd.unique(pd.concat(answers).to_numpy())
+
+    # Collect the (respondent, option) position of every answer given, plus the answered column
+    positions = [np.flatnonzero(df[col].notna()) for col in question_columns]
+    answered = np.unique(np.concatenate(positions))
+    respondents = np.concatenate(positions + [answered])
+    options = np.concatenate([get_group_codes(column, response_options) for column in answers]
+                             + [np.full(len(answered), len(response_options))])
+
+    shape = (len(df), len(response_options) + 1)
+    if sparse is not None and len(response_options) > SPARSE_OPTION_COUNT:
+        indicator = sparse.csr_matrix((np.ones(len(respondents), dtype=np.int64), (respondents, options)), shape=shape)
+        indicator.data[:] = 1  # Count an option once even if it was given in several columns
+    else:
+        indicator = np.zeros(shape, dtype=np.int64)
+        indicator[respondents, options] = 1
 
+    return response_options, indicator
 
-def get_single_multi_response(df, question, respondent):
-    # Identify columns containing responses for the question
-    question_columns = [col for col in df.columns if question in col]
-    responses = []
-
-    if question_columns:
-        # Loop through each column with responses for Q6
-        for col in question_columns:
-            # Drop empty cells and get unique responses in this column
-            response = df.loc[respondent, col]
-            if not pd.isna(response):
-                responses.append(response)
-    else:
-        print('Question not available. Please check that the provided question is valid for this sheet.')
-        sys.exit(1)
 
-    return responses
+def get_multi_responses(df, question, indicator=None):
+    if get_question_column(df, question) is None:
+        return None
+    if indicator is None:
+        indicator = get_indicator_matrix(df, question)
 
+    response_options, _ = indicator
+    return list(response_options)
 
-def get_overall_data(df, question):
-    response_options = get_multi_responses(df, question)
-    overall_count = 0
-    response_data = {response: 0 for response in response_options}
 
-    for i, row in df.iterrows():
-        responses = get_single_multi_response(df, question, i)
-        for response in responses:
-            if response in response_options:
-                response_data[response] += 1
-        # add to overall count only if the respondent participated in this question
-        if responses:
-            overall_count += 1
+def get_group_counts(group_codes, group_total, indicator):
+    """
+    Multiply the groups x respondents indicator matrix of group_codes with the respondents x options indicator matrix,
+    giving the number of respondents in each group who chose each option.
+    """
+    in_group = np.flatnonzero(group_codes >= 0)
+    if sparse is not None and sparse.issparse(indicator):
+        groups = sparse.csr_matrix((np.ones(len(in_group), dtype=np.int64), (group_codes[in_group], in_group)),
+                                   shape=(group_total, indicator.shape[0]))
+        return (groups @ indicator).toarray()
 
-    # Create new dataframe and calculate percentage
-    data = []
-    for response, count in response_data.items():
-        percentage = (count / overall_count)
-        data.append({'All respondents': 'All respondents',
-                     'Response': response,
-                     'Count': count,
-                     'Percentage': percentage})
+    counts = np.zeros((group_total, indicator.shape[1]), dtype=np.int64)
+    np.add.at(counts, group_codes[in_group], indicator[in_group])
+    return counts
 
-    return pd.DataFrame(data)
 
+def get_section_data(df, question, label, groups, indicator=None):
+    """
+    Return a DataFrame with the count and percentage of each response within each group, where the base of each group
+    is the respondents in it who chose at least one option. Groups where nobody answered the question are left out.
+    """
+    if indicator is None:
+        indicator = get_indicator_matrix(df, question)
+    response_options, matrix = indicator
 
-def get_gender_data(df, question):
-    response_options = get_multi_responses(df, question)
-    response_checker = False
-    gender_counts = {gender: 0 for gender in get_gender_list(df)}
-    genders = get_gender_list(df)
-    responses_by_gender = {gender: {response: 0 for response in response_options} for gender in genders}
-
-    for i, row in df.iterrows():
-        gender = get_gender(df, i)
-        responses = get_single_multi_response(df, question, i)
-        for response in responses:
-            if (gender in responses_by_gender
-                    and response in responses_by_gender[gender]):
-                responses_by_gender[gender][response] += 1
-                response_checker = True
-        # add to overall count only if the respondent participated in this question
-        if response_checker:
-            gender_counts[gender] += 1
-            response_checker = False
-
-    # Create new dataframe and calculate percentage
-    data = []
-    for gender, responses in responses_by_gender.items():
-        gender_count = gender_counts[gender]
-        for response, count in responses.items():
-            percentage = (count / gender_count)
-            data.append({'Generation': gender,
-                         'Response': response,
-                         'Count': count,
-                         'Percentage': percentage})
+    # Counts and base sizes both come from the one matrix product
+    group_codes, group_list = get_dimension_codes(groups)
+    counts = get_group_counts(group_codes, len(group_list), matrix)
 
-    return pd.DataFrame(data)
+    return get_section_data_from_counts(label, group_list, response_options, counts[:, :-1], counts[:, -1])
 
 
-def get_age_data(df, question):
-    response_options = get_multi_responses(df, question)
-    ages = get_age_list(df)
-    age_counts = {age: 0 for age in ages}
-    response_checker = False
-    responses_by_age = {age: {response: 0 for response in response_options} for age in ages}
-
-    for i, row in df.iterrows():
-        age = get_age(df, i)
-        responses = get_single_multi_response(df, question, i)
-        for response in responses:
-            if (age in responses_by_age
-                    and response in responses_by_age[age]):
-                responses_by_age[age][response] += 1
-                response_checker = True
-        # add to overall count only if the respondent participated in this question
-        if response_checker:
-            age_counts[age] += 1
-            response_checker = False
-
-    # Create new dataframe and calculate percentage
-    data = []
-    for age, responses in responses_by_age.items():
-        for response, count in responses.items():
-            percentage = (count / age_counts[age])
-            data.append({'Age': age,
-                         'Response': response,
-                         'Count': count,
-                         'Percentage': percentage})
+def get_section_data_from_counts(label, group_list, response_options, counts, group_counts):
+    answered = group_counts > 0
+    counts = counts[answered]
+    percentages = counts / group_counts[answered, np.newaxis]
+
+    # Create new dataframe with one row per group and response
+    group_list = group_list[answered]
+    response_options = np.asarray(response_options, dtype=object)
+    data = {label: np.repeat(group_list, len(response_options)),
+            'Response': np.tile(response_options, len(group_list)),
+            'Count': counts.ravel(),
+            'Percentage': percentages.ravel()}
 
     return pd.DataFrame(data)
 
 
-def get_generation_data(df, question):
-    response_options = get_multi_responses(df, question)
-    generation_counts = {generation: 0 for generation in get_generations_list()}
-    response_checker = False
-    generations = get_generations_list()
-    responses_by_generation = {generation: {response: 0 for response in response_options} for generation in generations}
-
-    for i, row in df.iterrows():
-        generation = get_generation(df, i)
-        responses = get_single_multi_response(df, question, i)
-        for response in responses:
-            if (generation in responses_by_generation
-                    and response in responses_by_generation[generation]):
-                responses_by_generation[generation][response] += 1
-                response_checker = True
-        # add to overall count only if the respondent participated in this question
-        if response_checker:
-            generation_counts[generation] += 1
-            response_checker = False
-
-    # Create new dataframe and calculate percentage
-    data = []
-    for generation, responses in responses_by_generation.items():
-        for response, count in responses.items():
-            percentage = (count / generation_counts[generation])
-            data.append({'Generation': generation,
-                         'Response': response,
-                         'Count': count,
-                         'Percentage': percentage})
+def get_counts(df, question, dimensions=None, indicator=None):
+    """
+    Count the options chosen within the groups of every section as count tables, which merge_counts can add up across
+    chunks of the sheet. Options are keyed by the first column and then the first row they're given in, the order
+    get_indicator_matrix lists them in.
+    """
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    if indicator is None:
+        indicator = get_indicator_matrix(df, question)
+    response_options, matrix = indicator
 
-    return pd.DataFrame(data)
+    option_keys = {}
+    for column_number, column in enumerate(get_answers(df, question)[1]):
+        for row, option in column.drop_duplicates().items():
+            option_keys.setdefault(option, (column_number, int(row)))
+    options = (response_options, [option_keys[option] for option in response_options])
 
+    counts = {}
+    for label, groups in get_section_groups(df, dimensions, SECTIONS).items():
+        group_codes, group_list = get_dimension_codes(groups)
+        section_counts = get_group_counts(group_codes, len(group_list), matrix)
+        group_axis = get_group_axis(df, groups)
+        counts[label] = {'Counts': make_count_table([group_axis, options], section_counts[:, :-1]),
+                         'Answered': make_count_table([group_axis], section_counts[:, -1])}
 
-def get_education_data(df, question):
-    response_options = get_multi_responses(df, question)
-    response_checker = False
-    education_counts = {education: 0 for education in get_education_list(df)}
-    education_levels = get_education_list(df)
-    responses_by_education = {education: {response: 0 for response in response_options} for education in education_levels}
-
-    for i, row in df.iterrows():
-        education = get_education(df, i)
-        responses = get_single_multi_response(df, question, i)
-        for response in responses:
-            if (education in responses_by_education
-                    and response in responses_by_education[education]):
-                responses_by_education[education][response] += 1
-                response_checker = True
-        # add to overall count only if the respondent participated in this question
-        if response_checker:
-            education_counts[education] += 1
-            response_checker = False
-
-    # Create new dataframe and calculate percentage
-    data = []
-    for education, responses in responses_by_education.items():
-        education_count = education_counts[education]
-        for response, count in responses.items():
-            percentage = (count / education_count)
-            data.append({'Education': education,
-                         'Response': response,
-                         'Count': count,
-                         'Percentage': percentage})
+    return counts
 
-    return pd.DataFrame(data)
 
+def get_overall_data(df, question, indicator=None):
+    groups = get_overall_groups(df, 'All respondents')
+    return get_section_data(df, question, 'All respondents', groups, indicator)
 
-def get_region_data(df, question):
-    response_options = get_multi_responses(df, question)
-    response_checker = False
-    region_counts = {region: 0 for region in get_region_list(df)}
-    regions = get_region_list(df)
-    responses_by_region = {region: {response: 0 for response in response_options} for region in regions}
-
-    for i, row in df.iterrows():
-        region = get_region(df, i)
-        responses = get_single_multi_response(df, question, i)
-        for response in responses:
-            if (region in responses_by_region
-                    and response in responses_by_region[region]):
-                responses_by_region[region][response] += 1
-                response_checker = True
-        # add to overall count only if the respondent participated in this question
-        if response_checker:
-            region_counts[region] += 1
-            response_checker = False
-
-    # Create new dataframe and calculate percentage
-    data = []
-    for region, responses in responses_by_region.items():
-        region_count = region_counts[region]
-        for response, count in responses.items():
-            percentage = (count / region_count)
-            data.append({'Region': region,
-                         'Response': response,
-                         'Count': count,
-                         'Percentage': percentage})
 
-    return pd.DataFrame(data)
+def get_gender_data(df, question, dimensions=None, indicator=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    return get_section_data(df, question, 'Gender', dimensions['Gender'], indicator)
 
 
-def write_section_to_csv(data, section_name, filename, mode='w'):
-    if isinstance(data, pd.DataFrame) and not data.empty:
-        with open(filename, mode) as f:
-            if mode == 'a':  # Add a newline before the section name only in append mode to avoid leading newlines
-                f.write("\n")
-            f.write(f"{section_name}\n")  # Write section name to CSV
-            data.to_csv(f, index=False, header=True)  # Append data under section name
-    else:
-        print(f"No {section_name.lower()} to write.")
+def get_age_data(df, question, dimensions=None, indicator=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    return get_section_data(df, question, 'Age', dimensions['Age'], indicator)
+
+
+def get_generation_data(df, question, dimensions=None, indicator=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    return get_section_data(df, question, 'Generation', dimensions['Generation'], indicator)
+
 
+def get_education_data(df, question, dimensions=None, indicator=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    return get_section_data(df, question, 'Education', dimensions['Education'], indicator)
 
-def export_data_to_csv(df, question, filename):
+
+def get_region_data(df, question, dimensions=None, indicator=None, level='Region'):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    return get_section_data(df, question, level, dimensions[level], indicator)
+
+
+def export_data_to_csv(df, question, filename, dimensions=None, sections=None):
     """
     Take the imported data, question, and export all required data to a new CSV with the corresponding filename,
-    appending each section of the data to the file.
+    appending each section of the data to the file. If sections is given, only the sections with those titles are
+    written. The sections are always returned as a dict of title to DataFrame, and only written if filename is set.
+    """
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    check_generation_sections(df.columns, dimensions.attrs.get('field_date'), sections)
+    indicator = get_indicator_matrix(df, question)
+    groups = get_section_groups(df, dimensions, SECTIONS)
+
+    def build_section(label):
+        return get_section_data(df, question, label, groups[label], indicator)
+
+    return export_sections(SECTIONS, build_section, filename, sections)
+
+
+def export_counts_to_csv(counts, filename, sections=None):
     """
-    # Write overall data or print warning
-    write_section_to_csv(get_overall_data(df, question), 'Overall Data', filename, 'w')
-    write_section_to_csv(get_gender_data(df, question), 'Gender Data', filename, 'a')
-    write_section_to_csv(get_age_data(df, question), 'Age Data', filename, 'a')
-  #  write_section_to_csv(get_generation_data(df, question), 'Generation Data', filename, 'a')
-    write_section_to_csv(get_education_data(df, question), 'Education Data', filename, 'a')
-    write_section_to_csv(get_region_data(df, question), 'Region Data', filename, 'a')
+    Write the sections of counts from get_counts, merged over the whole sheet, and return them the same way as
+    export_data_to_csv.
+    """
+    def build_section(label):
+        (group_list, response_options), section_counts = sort_count_table(counts[label]['Counts'])
+        _, group_counts = sort_count_table(counts[label]['Answered'])
+        return get_section_data_from_counts(label, group_list, response_options, section_counts, group_counts)
+
+    return export_sections(SECTIONS, build_section, filename, sections)
 
 
 if __name__ == "__main__":
     # Set variables for analysis
     report_folder = 'rg-2025-q2'
+    field_date = None  # Date the survey was in field (datetime.date), needed for generations when there's only an age
     question_number = '4'
     question_text = 'Have you ever presented AI-generated work as your own without telling anyone?'
 
     # Export data to CSV
     import_data_name = f'../csv_exports/{report_folder}/raw-data.csv'
-    data_frame = get_df_from_csv(import_data_name)
     my_question = f'Q{question_number}: {question_text}'
+    data_frame = get_df_from_csv(import_data_name, questions=[my_question])
+    dimensions = get_dimension_table(data_frame, import_data_name, field_date)
     export_data_name = f'../csv_exports/{report_folder}/Question {question_number}.csv'
-    export_data_to_csv(data_frame, my_question, export_data_name)
+    export_data_to_csv(data_frame, my_question, export_data_name, dimensions)
@@ -1,190 +1,152 @@
 import pandas as pd
-import datetime
+import numpy as np
 import sys
 from cross_question_functions import *
 
+# Label and title of each section, in the order they're written
+SECTIONS = {'All Respondents': 'Overall Data', 'Gender': 'Gender Data', 'Age': 'Age Data',
+            'Generation': 'Generation Data', 'Education': 'Education Data', 'Region': 'Region Data'}
+
 
 def get_single_response_options(df, question):
-    if question in df.columns:
-        unique_responses = df[question].dropna().unique()
+    column = get_question_column(df, question)
+    if column is not None:
+        unique_responses = get_unique_values(df[column])
         return unique_responses
     else:
         print('Question not available. Please check that the provided question is valid for this sheet.')
         sys.exit(1)
 
 
-def get_overall_data(df, question):
+def get_section_data(df, question, label, groups):
+    """
+    Count the responses for every group with one grouped count and return a DataFrame with the count and percentage
+    of each response within each group. Groups where nobody answered the question are left out.
+    """
     response_options = get_single_response_options(df, question)
-    overall_count = 0
-    responses = {response: 0 for response in response_options}
+    response_codes = get_group_codes(df[get_question_column(df, question)], response_options)
+    group_codes, group_list = get_dimension_codes(groups)
+    counts = count_by_group(group_codes, response_codes, len(group_list), len(response_options))
 
-    for _, row in df.iterrows():
-        response = row[question]
-        if response in responses:
-            responses[response] += 1
-            overall_count += 1
+    return get_section_data_from_counts(label, group_list, response_options, counts)
 
-    # Create new dataframe and calculate percentage
-    data = []
-    for response, count in responses.items():
-        percentage = count / overall_count
-        data.append({'All Respondents': 'All Respondents', 'Response': response, 'Count': count, 'Percentage': percentage})
 
-    return pd.DataFrame(data)
-
-def get_gender_data(df, question):
-    response_options = get_single_response_options(df, question)
-    genders = get_gender_list(df)
-    gender_counts = {gender: 0 for gender in genders}
-    responses_by_gender = {gender: {response: 0 for response in response_options} for gender in genders}
-
-    for i, row in df.iterrows():
-        gender = get_gender(df, i)
-        response = row[question]
-        if gender in responses_by_gender and response in responses_by_gender[gender]:
-            responses_by_gender[gender][response] += 1
-            gender_counts[gender] += 1
-
-    # Create new dataframe and calculate percentage
-    data = []
-    for gender, responses in responses_by_gender.items():
-        gender_count = gender_counts[gender]
-        for response, count in responses.items():
-            percentage = count/gender_count
-            data.append({'Gender': gender, 'Response': response, 'Count': count, 'Percentage': percentage})
+def get_section_data_from_counts(label, group_list, response_options, counts):
+    """
+    Return the section DataFrame for a groups x responses array of counts.
+    """
+    # Calculate percentage of each response within its group
+    group_counts = counts.sum(axis=1)
+    answered = group_counts > 0
+    counts = counts[answered]
+    percentages = counts / group_counts[answered, np.newaxis]
+
+    # Create new dataframe with one row per group and response
+    group_list = group_list[answered]
+    response_options = np.asarray(response_options, dtype=object)
+    data = {label: np.repeat(group_list, len(response_options)),
+            'Response': np.tile(response_options, len(group_list)),
+            'Count': counts.ravel(),
+            'Percentage': percentages.ravel()}
 
     return pd.DataFrame(data)
 
 
-def get_age_data(df, question):
+def get_counts(df, question, dimensions=None):
+    """
+    Count the responses within the groups of every section as count tables, which merge_counts can add up across
+    chunks of the sheet.
+    """
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
     response_options = get_single_response_options(df, question)
-    ages = get_age_list(df)
-    age_counts = {age: 0 for age in ages}
-    responses_by_age = {age: {response: 0 for response in response_options} for age in ages}
-
-    for i, row in df.iterrows():
-        age = get_age(df, i)
-        response = row[question]
-        if age in responses_by_age and response in responses_by_age[age]:
-            responses_by_age[age][response] += 1
-            age_counts[age] += 1
-
-    # Create new dataframe and calculate percentage
-    data = []
-    for age, responses in responses_by_age.items():
-        age_count = age_counts[age]
-        for response, count in responses.items():
-            percentage = count / age_count
-            data.append({'Age': age, 'Response': response, 'Count': count, 'Percentage': percentage})
+    response_codes = get_group_codes(df[get_question_column(df, question)], response_options)
+    responses = (response_options, get_first_rows(df, response_codes, len(response_options)))
 
-    return pd.DataFrame(data)
+    counts = {}
+    for label, groups in get_section_groups(df, dimensions, SECTIONS).items():
+        group_codes, group_list = get_dimension_codes(groups)
+        section_counts = count_by_group(group_codes, response_codes, len(group_list), len(response_options))
+        counts[label] = make_count_table([get_group_axis(df, groups), responses], section_counts)
 
+    return counts
 
-def get_generation_data(df, question):
-    response_options = get_single_response_options(df, question)
-    generation_counts = {generation: 0 for generation in get_generations_list()}
-    generations = get_generations_list()
-    responses_by_generation = {generation: {response: 0 for response in response_options} for generation in generations}
-
-    for i, row in df.iterrows():
-        generation = get_generation(df, i)
-        response = row[question]
-        if generation in responses_by_generation and response in responses_by_generation[generation]:
-            responses_by_generation[generation][response] += 1
-            generation_counts[generation] += 1
-
-    # Create new dataframe and calculate percentage
-    data = []
-    for generation, responses in responses_by_generation.items():
-        generation_count = generation_counts[generation]
-        for response, count in responses.items():
-            percentage = count / generation_count
-            data.append({'Generation': generation, 'Response': response, 'Count': count, 'Percentage': percentage})
 
-    return pd.DataFrame(data)
+def get_overall_data(df, question):
+    groups = get_overall_groups(df, 'All Respondents')
+    return get_section_data(df, question, 'All Respondents', groups)
 
 
-def get_education_data(df, question):
-    response_options = get_single_response_options(df, question)
-    education_counts = {education: 0 for education in get_education_list(df)}
-    education_levels = get_education_list(df)
-    responses_by_education = {education: {response: 0 for response in response_options} for education in education_levels}
-
-    for i, row in df.iterrows():
-        education = get_education(df, i)
-        response = row[question]
-        if education in responses_by_education and response in responses_by_education[education]:
-            responses_by_education[education][response] += 1
-            education_counts[education] += 1
-
-    # Create new dataframe and calculate percentage
-    data = []
-    for education, responses in responses_by_education.items():
-        education_count = education_counts[education]
-        for response, count in responses.items():
-            percentage = count/education_count
-            data.append({'Education': education, 'Response': response, 'Count': count, 'Percentage': percentage})
+def get_gender_data(df, question, dimensions=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    return get_section_data(df, question, 'Gender', dimensions['Gender'])
 
-    return pd.DataFrame(data)
 
+def get_age_data(df, question, dimensions=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    return get_section_data(df, question, 'Age', dimensions['Age'])
 
-def get_region_data(df, question):
-    response_options = get_single_response_options(df, question)
-    region_counts = {region: 0 for region in get_region_list(df)}
-    regions = get_region_list(df)
-    responses_by_region = {region: {response: 0 for response in response_options} for region in regions}
-
-    for i, row in df.iterrows():
-        region = get_region(df, i)
-        response = row[question]
-        if region in responses_by_region and response in responses_by_region[region]:
-            responses_by_region[region][response] += 1
-            region_counts[region] += 1
-
-    # Create new dataframe and calculate percentage
-    data = []
-    for region, responses in responses_by_region.items():
-        region_count = region_counts[region]
-        for response, count in responses.items():
-            percentage = count/region_count
-            data.append({'Region': region, 'Response': response, 'Count': count, 'Percentage': percentage})
 
-    return pd.DataFrame(data)
+def get_generation_data(df, question, dimensions=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    return get_section_data(df, question, 'Generation', dimensions['Generation'])
 
 
-def write_section_to_csv(data, section_name, filename, mode='w'):
-    if isinstance(data, pd.DataFrame) and not data.empty:
-        with open(filename, mode) as f:
-            if mode == 'a':  # Add a newline before the section name only in append mode to avoid leading newlines
-                f.write("\n")
-            f.write(f"{section_name}\n")  # Write section name to CSV
-            data.to_csv(f, index=False, header=True)  # Append data under section name
-    else:
-        print(f"No {section_name.lower()} to write.")
+def get_education_data(df, question, dimensions=None):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    return get_section_data(df, question, 'Education', dimensions['Education'])
+
+
+def get_region_data(df, question, dimensions=None, level='Region'):
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    return get_section_data(df, question, level, dimensions[level])
 
 
-def export_data_to_csv(df, question, filename):
+def export_data_to_csv(df, question, filename, dimensions=None, sections=None):
     """
     Take the imported data, question, and export all required data to a new CSV with the corresponding filename,
-    appending each section of the data to the file.
+    appending each section of the data to the file. If sections is given, only the sections with those titles are
+    written. The sections are always returned as a dict of title to DataFrame, and only written if filename is set.
     """
-    write_section_to_csv(get_overall_data(df, question), 'Overall Data', filename, 'w')
-    write_section_to_csv(get_gender_data(df, question), 'Gender Data', filename, 'a')
-    write_section_to_csv(get_age_data(df, question), 'Age Data', filename, 'a')
-#    write_section_to_csv(get_generation_data(df, question), 'Generation Data', filename, 'a')
-    write_section_to_csv(get_education_data(df, question), 'Education Data', filename, 'a')
-    write_section_to_csv(get_region_data(df, question), 'Region Data', filename, 'a')
+    if dimensions is None:
+        dimensions = get_dimension_table(df)
+    check_generation_sections(df.columns, dimensions.attrs.get('field_date'), sections)
+    groups = get_section_groups(df, dimensions, SECTIONS)
+
+    def build_section(label):
+        return get_section_data(df, question, label, groups[label])
+
+    return export_sections(SECTIONS, build_section, filename, sections)
+
+
+def export_counts_to_csv(counts, filename, sections=None):
+    """
+    Write the sections of counts from get_counts, merged over the whole sheet, and return them the same way as
+    export_data_to_csv.
+    """
+    def build_section(label):
+        (group_list, response_options), section_counts = sort_count_table(counts[label])
+        return get_section_data_from_counts(label, group_list, response_options, section_counts)
+
+    return export_sections(SECTIONS, build_section, filename, sections)
 
 
 if __name__ == "__main__":
     # Set variables for analysis
     report_folder = 'rg-2025-q2'
+    field_date = None  # Date the survey was in field (datetime.date), needed for generations when there's only an age
     question_number = '15'
     question_text = 'Do you have a side hustle alongside your full-time job? If so, what is the primary reason?'
 
     # Export data to CSV
     import_data_name = f'../csv_exports/{report_folder}/raw-data.csv'
-    data_frame = get_df_from_csv(import_data_name)
     my_question = f'Q{question_number}: {question_text}'
+    data_frame = get_df_from_csv(import_data_name, questions=[my_question])
+    dimensions = get_dimension_table(data_frame, import_data_name, field_date)
     export_data_name = f'../csv_exports/{report_folder}/Question {question_number}.csv'
-    export_data_to_csv(data_frame, my_question, export_data_name)
+    export_data_to_csv(data_frame, my_question, export_data_name, dimensions)